@@ -0,0 +1,73 @@
+"""Benchmark decoding recorded search pages into SearchInfo rows.
+
+Record pages once with --record, then compare the rows per second of
+Response.json() style decoding with each installed decoder backend.
+"""
+import argparse
+import json
+import os
+import time
+from typing import Callable, List, Optional
+
+from storeclient.client import Client
+from storeclient.decoder import DECODERS
+from storeclient.store import SearchInfo
+
+
+def record(directory: str, pages: int) -> None:
+    os.makedirs(directory, exist_ok=True)
+    client = Client()
+    for page in range(1, pages + 1):
+        r = client.search(page=page, page_size=100)
+        r.raise_for_status()
+        with open(os.path.join(directory, f'page-{page:06d}.json'), 'wb') as f:
+            f.write(r.content)
+
+
+def response_json(data: bytes):
+    # What requests does: decode the body to str, then parse it.
+    return json.loads(data.decode('utf-8'))
+
+
+def bench(decode: Callable[[bytes], dict],
+          pages: List[bytes],
+          repeat: int) -> float:
+    rows = 0
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for data in pages:
+            for row in decode(data)['_embedded']['clickindex:package']:
+                SearchInfo.from_json(row)
+                rows += 1
+    return rows / (time.perf_counter() - started)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('directory')
+    parser.add_argument('--record', type=int, metavar='PAGES', default=None,
+                        help='record this many search pages first')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    if args.record:
+        record(args.directory, args.record)
+    pages = []
+    for filename in sorted(os.listdir(args.directory)):
+        with open(os.path.join(args.directory, filename), 'rb') as f:
+            pages.append(f.read())
+
+    rate = bench(response_json, pages, args.repeat)
+    print(f'{"Response.json()":16} {rate:12.0f} rows/s')
+    for name, decoder_class in DECODERS.items():
+        try:
+            decoder = decoder_class()
+        except ImportError:
+            print(f'{name:16} not installed')
+            continue
+        rate = bench(decoder.decode, pages, args.repeat)
+        print(f'{name:16} {rate:12.0f} rows/s')
+
+
+if __name__ == '__main__':
+    main()
@@ -3,7 +3,8 @@ import sys
 
 from storeclient.client import Client
 from storeclient.enums import MediaType
-from storeclient.store import Store, SearchInfo
+from storeclient.export import MediaDownloader, export_media
+from storeclient.store import Store
 
 
 def search():
@@ -13,16 +14,11 @@ def search():
 
 def all_media():
     store = Store()
-    with open('media.txt', 'wt') as f:
-        info: SearchInfo
-        for info in store.search():
-            print(info, info.icon_url)
-            #snap = store.snap(info.package_name)
-            #print(snap.media())
-            if info.icon_url:
-                f.write(f'icon {info.package_name} {info.icon_url}\n')
-            for screenshot in info.screenshot_urls:
-                f.write(f'screenshot {info.package_name} {screenshot}\n')
+    with MediaDownloader('media_files') as downloader:
+        state = export_media(store, 'media.jsonl', downloader=downloader)
+    print(f'Exported {state.rows} media references')
+    for url, error in downloader.failures.items():
+        print(f'Failed to download {url}: {error}')
 
 
 def sizes():
@@ -72,4 +68,5 @@ def main():
     else:
         raise SystemExit(f"Invalid action: {action}")
 
-main()
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+import argparse
+import collections
+import hashlib
+import json
+import os
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import (Deque, Dict, Iterable, Iterator, List, NamedTuple,
+                    Optional, Set, Tuple)
+
+from PIL import Image
+
+from parsemedia import MediaRow, fetch_media, open_export, read_batches
+
+THUMBNAIL_SIZE = (320, 320)
+HASH_BITS = 64
+
+
+class ProcessedMedia(NamedTuple):
+    snap_name: str
+    media_type: str
+    local: str
+    content_hash: str
+    thumbnail: str
+    phash: int
+
+
+def content_hash(local: str) -> str:
+    sha = hashlib.sha256()
+    with open(local, 'rb') as fd:
+        for block in iter(lambda: fd.read(64 * 1024), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def open_reduced(local: str, size: Tuple[int, int]) -> Image.Image:
+    """Open an image decoded at close to size rather than at full size.
+
+    JPEG files are decoded directly at a reduced scale with draft(), other
+    formats are shrunk with the integer box filter of reduce().
+    """
+    img = Image.open(local)
+    img.draft('RGB', size)
+    # reduce() only supports some modes, palette and 1-bit images are
+    # common for GIF and PNG screenshots.
+    if img.mode not in ('RGB', 'RGBA', 'L'):
+        img = img.convert('RGBA')
+    factor = min(img.width // size[0], img.height // size[1])
+    if factor > 1:
+        img = img.reduce(factor)
+    return img
+
+
+def dhash(img: Image.Image, hash_size: int = 8) -> int:
+    """Difference hash comparing horizontally adjacent pixels."""
+    pixels = list(img.convert('L').resize(
+        (hash_size + 1, hash_size), Image.BILINEAR).getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value <<= 1
+            value |= pixels[offset + col] < pixels[offset + col + 1]
+    return value
+
+
+def process_file(local: str, cache_dir: str) -> Tuple[str, str, int]:
+    """Create a thumbnail and hash for local, cached by its content hash.
+
+    Returns the content hash, the thumbnail path and the perceptual hash.
+    """
+    digest = content_hash(local)
+    meta = os.path.join(cache_dir, f'{digest}.json')
+    if os.path.exists(meta):
+        with open(meta, 'rt') as f:
+            cached = json.load(f)
+        return digest, cached['thumbnail'], cached['phash']
+
+    img = open_reduced(local, THUMBNAIL_SIZE)
+    phash = dhash(img)
+    thumbnail = os.path.join(cache_dir, f'{digest}.png')
+    img.thumbnail(THUMBNAIL_SIZE)
+    img.save(thumbnail)
+    with open(meta + '.tmp', 'wt') as f:
+        json.dump({'thumbnail': thumbnail, 'phash': phash}, f)
+    os.replace(meta + '.tmp', meta)
+    return digest, thumbnail, phash
+
+
+def _fetch(row: MediaRow, media_dir: str) -> Optional[str]:
+    try:
+        return fetch_media(row, media_dir)
+    except Exception as e:
+        print(f'Skipping {row.snap_name} {row.path}: {e}')
+        return None
+
+
+def _collect(batch: List[Tuple[MediaRow, str, Future]]
+             ) -> Iterator[ProcessedMedia]:
+    for media_row, local, future in batch:
+        try:
+            digest, thumbnail, phash = future.result()
+        except Exception as e:
+            print(f'Skipping {local}: {e}')
+            continue
+        yield ProcessedMedia(
+            snap_name=media_row.snap_name,
+            media_type=media_row.media_type,
+            local=local,
+            content_hash=digest,
+            thumbnail=thumbnail,
+            phash=phash,
+        )
+
+
+def process_media(batches: Iterable[List[MediaRow]],
+                  media_dir: str,
+                  cache_dir: str,
+                  *,
+                  workers: Optional[int] = None,
+                  download_workers: int = 8,
+                  max_pending: int = 2) -> Iterator[ProcessedMedia]:
+    """Download, thumbnail and hash batches of media in parallel.
+
+    Each batch from read_batches() is downloaded on a thread pool and then
+    handed to a process pool. At most max_pending batches are processed
+    while the next one downloads, so memory does not grow with the size
+    of the export. Files that fail to download or decode are skipped.
+    """
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir)
+    pending: Deque[List[Tuple[MediaRow, str, Future]]] = collections.deque()
+    with ThreadPoolExecutor(max_workers=download_workers) as downloads, \
+            ProcessPoolExecutor(max_workers=workers) as executor:
+        for batch in batches:
+            locals_ = downloads.map(lambda row: _fetch(row, media_dir), batch)
+            pending.append([
+                (media_row, local,
+                 executor.submit(process_file, local, cache_dir))
+                for media_row, local in zip(batch, locals_)
+                if local is not None])
+            while len(pending) > max_pending:
+                yield from _collect(pending.popleft())
+        while pending:
+            yield from _collect(pending.popleft())
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+
+class HashIndex:
+    """Find perceptual hashes within max_distance bits of each other.
+
+    The hash is split into max_distance + 1 bands. Two hashes that differ
+    in at most max_distance bits must be identical in at least one band,
+    so a lookup only compares against entries sharing a band instead of
+    scanning the whole index.
+    """
+
+    def __init__(self, max_distance: int = 4, bits: int = HASH_BITS) -> None:
+        self.max_distance = max_distance
+        nbands = max_distance + 1
+        self._bands: List[Tuple[int, int]] = []
+        start = 0
+        for band in range(nbands):
+            width = (bits - start) // (nbands - band)
+            self._bands.append((start, (1 << width) - 1))
+            start += width
+        self._tables: List[Dict[int, List[int]]] = [
+            collections.defaultdict(list) for _ in self._bands]
+        self._hashes: List[int] = []
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    def _keys(self, value: int) -> Iterator[int]:
+        for shift, mask in self._bands:
+            yield (value >> shift) & mask
+
+    def add(self, value: int) -> int:
+        """Add a hash, returning its position in the index."""
+        position = len(self._hashes)
+        self._hashes.append(value)
+        for table, key in zip(self._tables, self._keys(value)):
+            table[key].append(position)
+        return position
+
+    def query(self, value: int) -> List[Tuple[int, int]]:
+        """Return (position, distance) of every hash close to value."""
+        candidates: Set[int] = set()
+        for table, key in zip(self._tables, self._keys(value)):
+            candidates.update(table.get(key, ()))
+        matches = []
+        for position in sorted(candidates):
+            distance = hamming(value, self._hashes[position])
+            if distance <= self.max_distance:
+                matches.append((position, distance))
+        return matches
+
+
+def find_duplicates(items: Iterable[ProcessedMedia],
+                    max_distance: int = 4) -> List[List[ProcessedMedia]]:
+    """Group screenshots that are near duplicates of each other."""
+    index = HashIndex(max_distance)
+    groups: List[List[ProcessedMedia]] = []
+    group_of: List[int] = []
+    for item in items:
+        if item.media_type != 'screenshot':
+            continue
+        matches = index.query(item.phash)
+        index.add(item.phash)
+        if matches:
+            group = group_of[matches[0][0]]
+            groups[group].append(item)
+        else:
+            group = len(groups)
+            groups.append([item])
+        group_of.append(group)
+    return [group for group in groups if len(group) > 1]
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description='Create thumbnails and find duplicate screenshots')
+    parser.add_argument('filename', nargs='?', default='-',
+                        help='CSV export, optionally gzipped, - for stdin')
+    parser.add_argument('--media-dir', default='media_files')
+    parser.add_argument('--cache-dir', default='media_thumbnails')
+    parser.add_argument('--max-distance', type=int, default=4)
+    parser.add_argument('-j', '--workers', type=int, default=None)
+    parser.add_argument('--download-workers', type=int, default=8)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.media_dir):
+        os.makedirs(args.media_dir)
+
+    with open_export(args.filename) as fp:
+        items = process_media(read_batches(fp, args.batch_size),
+                              args.media_dir, args.cache_dir,
+                              workers=args.workers,
+                              download_workers=args.download_workers)
+        for group in find_duplicates(items, args.max_distance):
+            print(' '.join(f'{item.snap_name}:{item.local}'
+                           for item in group))
+
+
+if __name__ == '__main__':
+    main()
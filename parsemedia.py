@@ -1,13 +1,22 @@
+import argparse
 import collections
 import csv
+import gzip
 import hashlib
+import io
+import itertools
 import math
 import os
 import pprint
+import queue
+import sys
+import threading
 import urllib.request
-from typing import Iterator, NamedTuple
+from typing import (Counter, Dict, Iterable, Iterator, List, NamedTuple,
+                    Optional, TextIO, Tuple)
 from urllib.parse import quote
 
+import numpy as np
 from PIL import Image
 
 
@@ -72,54 +81,208 @@ def get_avg_fps(img: Image) -> float:
 
 
 def download(url, local, media_hash):
-    urllib.request.urlretrieve(url, local)
-    if not media_hash:
+    """Download url to local, returning False if its hash does not match.
+
+    The file is written under a temporary name and only renamed to local
+    once complete and verified, so an interrupted download is not mistaken
+    for a cached file.
+    """
+    tmp = local + '.part'
+    try:
+        urllib.request.urlretrieve(url, tmp)
+        if media_hash:
+            with open(tmp, 'rb') as fd:
+                file_hash = hashlib.sha256(fd.read()).hexdigest()
+            if file_hash != media_hash:
+                print(local, f'differs {file_hash} != {media_hash}')
+                return False
+        os.replace(tmp, local)
         return True
-    with open(local, 'rb') as fd:
-        file_hash = hashlib.sha256(fd.read()).hexdigest()
-        if file_hash == media_hash:
-            return True
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
 
-        print(local, f'differs {file_hash} != {media_hash}')
-        return False
+
+class MediaRow(NamedTuple):
+    snap_name: str
+    id: str
+    media_type: str
+    url: str
+    media_name: str
+    media_hash: str
+    path: str
+
+
+def normalise_row(row: List[str]) -> Optional[MediaRow]:
+    """Validate a row of the DB export, returning None if it is unusable."""
+    if len(row) != len(MediaRow._fields):
+        print(f'Skipping malformed row: {row!r}')
+        return None
+    media_row = MediaRow(*row)
+    if not media_row.path:
+        return None
+    return media_row._replace(snap_name=media_row.snap_name.replace(',', ';'))
+
+
+def fetch_media(row: MediaRow, media_dir: str, retries: int = 3) -> str:
+    """Download the media file of row unless it is cached, returning its path.
+
+    Raises ValueError if the download does not match the hash of the row
+    after retries attempts.
+    """
+    url = MEDIA_ROOT + quote(row.path)
+    local = f'{media_dir}/{row.id}.{os.path.basename(url)}'
+    if not os.path.exists(local):
+        for _ in range(retries):
+            print(f'Downloading {row.snap_name} {local}')
+            if download(url, local, row.media_hash):
+                break
+        else:
+            raise ValueError(f'Hash of {url} does not match {row.media_hash}')
+    return local
+
+
+def analyse_media(row: MediaRow, local: str) -> MediaInfo:
+    img = Image.open(local)
+    framecount = getattr(img, 'n_frames', 0)
+    fps = get_avg_fps(img)
+    length = framecount * fps
+    return MediaInfo(
+        snap_name=row.snap_name,
+        media_type=row.media_type,
+        filename=os.path.basename(MEDIA_ROOT + quote(row.path)),
+        format=img.format,
+        width=img.width,
+        height=img.height,
+        aspect_ratio=calculate_aspect(img.width, img.height),
+        size=os.path.getsize(local),
+        framecount=framecount,
+        fps=fps,
+        length=length,
+    )
 
 
 def parse_media(rows: Iterator, media_dir: str) -> Iterator[MediaInfo]:
     for row in rows:
-        (snap_name, id, media_type, media_url,
-         media_name, media_hash, path) = row
-        snap_name = snap_name.replace(',', ';')
-        if not path:
+        media_row = normalise_row(row)
+        if media_row is None:
             continue
-        url = MEDIA_ROOT + quote(path)
-        filename = os.path.basename(url)
-        local = f'{media_dir}/{id}.{filename}'
-        if not os.path.exists(local):
-            while True:
-                print(f'Downloading {snap_name} {local}')
-                if download(url, local, media_hash):
-                    break
+        yield analyse_media(media_row, fetch_media(media_row, media_dir))
 
-        img = Image.open(local)
-        framecount = getattr(img, 'n_frames', 0)
-        fps = get_avg_fps(img)
-        length = framecount * fps
-        yield MediaInfo(
-            snap_name=snap_name,
-            media_type=media_type,
-            filename=filename,
-            format=img.format,
-            width=img.width,
-            height=img.height,
-            aspect_ratio=calculate_aspect(img.width, img.height),
-            size=os.path.getsize(local),
-            framecount=framecount,
-            fps=fps,
-            length=length,
-        )
-
-
-def summary(rows: Iterator[MediaInfo]) -> None:
+
+def open_export(filename: str) -> TextIO:
+    """Open a CSV export, which may be gzip compressed or '-' for stdin."""
+    if filename == '-':
+        return io.TextIOWrapper(sys.stdin.buffer, newline='')
+    if filename.endswith('.gz'):
+        return gzip.open(filename, 'rt', newline='')
+    return open(filename, 'rt', newline='')
+
+
+def read_batches(fp: TextIO,
+                 batch_size: int = 1000) -> Iterator[List[MediaRow]]:
+    """Read and normalise the export batch_size rows at a time."""
+    reader = csv.reader(fp)
+    while True:
+        rows = list(itertools.islice(reader, batch_size))
+        if not rows:
+            break
+        batch = [media_row for media_row in map(normalise_row, rows)
+                 if media_row is not None]
+        if batch:
+            yield batch
+
+
+_DONE = object()
+
+
+class MediaPipeline:
+    """Connect the ingest, download, analyse and summary stages.
+
+    Each stage runs in its own thread(s) and passes batches to the next
+    one through a bounded queue, so a slow stage blocks the ones feeding
+    it and at most queue_size batches are in flight between two stages.
+    """
+
+    def __init__(self,
+                 media_dir: str,
+                 *,
+                 queue_size: int = 4,
+                 download_workers: int = 8) -> None:
+        self.media_dir = media_dir
+        self.download_workers = download_workers
+        self._download_queue = queue.Queue(maxsize=queue_size)
+        self._analyse_queue = queue.Queue(maxsize=queue_size)
+        self._summary_queue = queue.Queue(maxsize=queue_size)
+        self._errors: List[BaseException] = []
+
+    def _run_stage(self, target, inbox, outbox, producers=1):
+        """Apply target to every batch of inbox and pass results on.
+
+        After an error the stage keeps draining its inbox, so upstream
+        stages never block on a full queue.
+        """
+        finished = 0
+        while finished < producers:
+            batch = inbox.get()
+            if batch is _DONE:
+                finished += 1
+                continue
+            if self._errors:
+                continue
+            try:
+                outbox.put(target(batch))
+            except BaseException as e:
+                self._errors.append(e)
+        outbox.put(_DONE)
+
+    def _ingest(self, batches: Iterator[List[MediaRow]]) -> None:
+        try:
+            for batch in batches:
+                if self._errors:
+                    break
+                self._download_queue.put(batch)
+        except BaseException as e:
+            self._errors.append(e)
+        for _ in range(self.download_workers):
+            self._download_queue.put(_DONE)
+
+    def _download(self, batch: List[MediaRow]) -> List[Tuple[MediaRow, str]]:
+        return [(row, fetch_media(row, self.media_dir)) for row in batch]
+
+    def _analyse(self, batch: List[Tuple[MediaRow, str]]) -> List[MediaInfo]:
+        return [analyse_media(row, local) for row, local in batch]
+
+    def _infos(self) -> Iterator[MediaInfo]:
+        while True:
+            batch = self._summary_queue.get()
+            if batch is _DONE:
+                break
+            yield from batch
+
+    def run(self, batches: Iterator[List[MediaRow]]) -> Dict[str, Counter]:
+        threads = [threading.Thread(target=self._ingest, args=(batches,))]
+        for _ in range(self.download_workers):
+            threads.append(threading.Thread(
+                target=self._run_stage,
+                args=(self._download, self._download_queue,
+                      self._analyse_queue)))
+        threads.append(threading.Thread(
+            target=self._run_stage,
+            args=(self._analyse, self._analyse_queue, self._summary_queue,
+                  self.download_workers)))
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        counters = count_media(self._infos())
+        for thread in threads:
+            thread.join()
+        if self._errors:
+            raise self._errors[0]
+        return counters
+
+
+def count_media(rows: Iterator[MediaInfo]) -> Dict[str, Counter]:
     counters = dict(
         media_types=collections.Counter(),
         aspect_ratios=collections.Counter(),
@@ -202,7 +365,117 @@ def summary(rows: Iterator[MediaInfo]) -> None:
         else:
             c[str(value)] += 1
     counters['screenshots'] = c
+    return counters
 
+
+class MediaTable:
+    """MediaInfo rows stored column by column in NumPy arrays."""
+
+    def __init__(self, columns: Dict[str, np.ndarray]) -> None:
+        self.columns = columns
+
+    def __len__(self) -> int:
+        return len(self.columns['snap_name'])
+
+    def __getattr__(self, name: str) -> np.ndarray:
+        try:
+            return self.columns[name]
+        except KeyError:
+            raise AttributeError(name)
+
+    @classmethod
+    def from_infos(cls, rows: Iterable[MediaInfo]) -> 'MediaTable':
+        values = list(zip(*rows)) or [()] * len(MediaInfo._fields)
+        columns = {}
+        for name, column in zip(MediaInfo._fields, values):
+            dtype = MEDIA_TABLE_DTYPES[MediaInfo.__annotations__[name]]
+            columns[name] = np.array(column, dtype=dtype)
+        return cls(columns)
+
+
+MEDIA_TABLE_DTYPES = {
+    str: np.str_,
+    int: np.int64,
+    float: np.float64,
+}
+
+
+def _ordered_counter(labels: np.ndarray) -> Counter:
+    """Count labels in the order they first appear, like a Counter would."""
+    if not len(labels):
+        return collections.Counter()
+    keys, first, counts = np.unique(
+        labels, return_index=True, return_counts=True)
+    return collections.Counter(
+        {keys[i].item(): counts[i].item() for i in np.argsort(first)})
+
+
+def count_media_columnar(table: MediaTable) -> Dict[str, Counter]:
+    """Vectorised equivalent of count_media() operating on a MediaTable."""
+    media_type = np.where(
+        table.media_type == 'icon_256', 'icon', table.media_type)
+    is_icon = media_type == 'icon'
+    is_screenshot = media_type == 'screenshot'
+    counters = dict(
+        media_types=_ordered_counter(media_type),
+    )
+
+    aspect_ratios = _ordered_counter(table.aspect_ratio[is_screenshot])
+    if aspect_ratios:
+        items = list(aspect_ratios.items())
+        items.insert(1, ('Total', int(is_screenshot.sum())))
+        aspect_ratios = collections.Counter(dict(items))
+    counters['aspect_ratios'] = aspect_ratios
+    counters['formats'] = _ordered_counter(table.format)
+
+    counters['resolutions'] = _ordered_counter(np.select(
+        [is_icon,
+         table.width < 480,
+         table.height < 480,
+         table.width > 3840,
+         table.height > 2160],
+        ['ok',
+         'width too small',
+         'height too small',
+         'width too big',
+         'height too big'],
+        default='ok'))
+
+    counters['sizes'] = _ordered_counter(np.select(
+        [(media_type == 'icon_256') & (table.size > 256 * 1024),
+         is_screenshot & (table.size > 2 * 1024 * 1024)],
+        ['icon too big', 'screenshot too big'],
+        default=media_type))
+
+    fps = table.fps[table.fps != 0]
+    counters['fps'] = _ordered_counter(np.select(
+        [fps < 1, fps > 30], ['< 1', '> 30'], default='1..30'))
+
+    length = table.length[table.length != 0]
+    counters['length'] = _ordered_counter(
+        np.where(length > 30, '> 30', '<= 30'))
+
+    counters['totals'] = _ordered_counter(np.full(len(table), 'total'))
+
+    _, first, inverse = np.unique(
+        table.snap_name, return_index=True, return_inverse=True)
+    per_snap = np.bincount(inverse, weights=is_screenshot,
+                           minlength=len(first)).astype(np.int64)
+    per_snap = per_snap[np.argsort(first)]
+    counters['screenshots'] = _ordered_counter(
+        np.where(per_snap >= 10, '10+', per_snap.astype(np.str_)))
+    return counters
+
+
+def summary(rows: Iterator[MediaInfo], columnar: bool = False) -> None:
+    if columnar:
+        counters = count_media_columnar(MediaTable.from_infos(rows))
+    else:
+        counters = count_media(rows)
+    print_summary(counters)
+
+
+def print_summary(counters: Dict[str, Counter]) -> None:
     pprint.pprint(
         {name.capitalize(): counter.most_common(10)
          for name, counter in counters.items()}
@@ -210,17 +483,28 @@ def summary(rows: Iterator[MediaInfo]) -> None:
 
 
 
-def main(filename: str) -> None:
-    media_dir = 'media_files'
-    if not os.path.exists(media_dir):
-        os.makedirs(media_dir)
-
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description='Summarise the media of a DB export')
     # \copy ($DB_QUERY) To '/tmp/filename.csv' WITH CSV;
-    rows = csv.reader(open(filename, 'rt'))
-    infos = parse_media(rows, media_dir)
-    summary(infos)
+    parser.add_argument('filename', nargs='?', default='-',
+                        help='CSV export, optionally gzipped, - for stdin')
+    parser.add_argument('--media-dir', default='media_files')
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--queue-size', type=int, default=4)
+    parser.add_argument('--download-workers', type=int, default=8)
+    args = parser.parse_args(argv)
+
+    if not os.path.exists(args.media_dir):
+        os.makedirs(args.media_dir)
+
+    pipeline = MediaPipeline(args.media_dir,
+                             queue_size=args.queue_size,
+                             download_workers=args.download_workers)
+    with open_export(args.filename) as fp:
+        counters = pipeline.run(read_batches(fp, args.batch_size))
+    print_summary(counters)
 
 
 if __name__ == '__main__':
-    main('/home/jdahlin/scaprod-media.csv')
-    #main(sys.argv[1])
+    main()
@@ -0,0 +1,3 @@
+from storeclient.cli import main
+
+main()
@@ -0,0 +1,118 @@
+"""Command line interface to the snap store.
+
+Only argparse is imported up front, the client and its dependencies are
+imported by the command that needs them so short invocations start fast.
+"""
+import argparse
+import os
+import sys
+from typing import List, Optional
+
+
+def _client(args: argparse.Namespace):
+    from storeclient.client import Client
+
+    password = None
+    if args.email:
+        password = os.environ.get('STORECLIENT_PASSWORD')
+        if password is None:
+            import getpass
+            password = getpass.getpass(f'Password for {args.email}: ')
+    return Client(email=args.email,
+                  password=password,
+                  environment=args.environment)
+
+
+def _store(args: argparse.Namespace):
+    from storeclient.store import Store
+    return Store(_client(args))
+
+
+def search(args: argparse.Namespace) -> None:
+    for info in _store(args).search(args.text):
+        print(f'{info.package_name}\t{info.version}\t{info.summary}')
+
+
+def info(args: argparse.Namespace) -> None:
+    snap = _store(args).snap(args.name)
+    print(f'name: {snap.name}')
+    print(f'snap-id: {snap.id}')
+    for channel in snap.channels:
+        print(f'{channel.track}/{channel.risk.value}\t'
+              f'{channel.architecture}\t{channel.revision}\t'
+              f'{channel.version}\t{channel.released_at.isoformat()}')
+
+
+def media_view(args: argparse.Namespace) -> None:
+    import pprint
+    pprint.pprint(_client(args).get_binary_metadata(args.snap_id))
+
+
+def media_add(args: argparse.Namespace) -> None:
+    from storeclient.enums import MediaType
+    _client(args).append_binary_metadata(
+        args.snap_id, MediaType[args.media_type], file=args.filename)
+
+
+def media_clear(args: argparse.Namespace) -> None:
+    _client(args).clear_binary_metadata(args.snap_id)
+
+
+def download(args: argparse.Namespace) -> None:
+    for result in _store(args).search(args.name):
+        if result.package_name == args.name:
+            result.download(args.output)
+            return
+    raise SystemExit(f'Snap not found: {args.name}')
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='storeclient')
+    parser.add_argument('-e', '--environment', default='production',
+                        choices=['local', 'staging', 'production'])
+    parser.add_argument('--email', default=os.environ.get('STORECLIENT_EMAIL'),
+                        help='account used for commands that need '
+                             'authorization, the password is read from '
+                             'STORECLIENT_PASSWORD or prompted for')
+    commands = parser.add_subparsers(dest='command', metavar='command')
+    commands.required = True
+
+    sub = commands.add_parser('search', help='search the store')
+    sub.add_argument('text', nargs='?')
+    sub.set_defaults(func=search)
+
+    sub = commands.add_parser('info', help='show the channels of a snap')
+    sub.add_argument('name')
+    sub.set_defaults(func=info)
+
+    sub = commands.add_parser('download', help='download a snap')
+    sub.add_argument('name')
+    sub.add_argument('-o', '--output', default=None)
+    sub.set_defaults(func=download)
+
+    media = commands.add_parser(
+        'media', help='manage the media of a snap').add_subparsers(
+        dest='action', metavar='action')
+    media.required = True
+    sub = media.add_parser('view', help='show the media of a snap')
+    sub.add_argument('snap_id')
+    sub.set_defaults(func=media_view)
+    sub = media.add_parser('add', help='add an icon, banner or screenshot')
+    sub.add_argument('snap_id')
+    sub.add_argument('media_type',
+                     choices=['icon', 'banner', 'banner_icon', 'screenshot'])
+    sub.add_argument('filename')
+    sub.set_defaults(func=media_add)
+    sub = media.add_parser('clear', help='remove all media of a snap')
+    sub.add_argument('snap_id')
+    sub.set_defaults(func=media_clear)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args = get_parser().parse_args(argv)
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
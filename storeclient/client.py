@@ -1,18 +1,20 @@
 import datetime
-import hashlib
 import json
-import mimetypes
-import pprint
 import os
 import sys
+import threading
 from functools import lru_cache
-from typing import Any, BinaryIO, Dict, List, Optional, Tuple, Union
-
-from pymacaroons import Macaroon
-from requests import Response, Session, HTTPError
+from typing import (TYPE_CHECKING, Any, BinaryIO, Callable, Dict, List,
+                    Optional, Tuple, Union)
 
+from storeclient.decoder import Decoder, get_decoder
 from storeclient.enums import MediaType
 
+# requests and pymacaroons are slow to import, so they are only imported
+# once a client actually talks to the store.
+if TYPE_CHECKING:
+    from requests import Response, Session
+
 HttpKey = Union[bytes, str]
 HttpValue = Union[bytes, str, int]
 HttpData = Union[Dict[HttpKey, HttpValue],
@@ -33,37 +35,54 @@ ALL_PERMISSIONS = [
     'store_admin',
     'store_review',
 ]
-CONSTANTS = {
-    'local': {
-        'sso_location': os.environ.get(
-            'SSO_LOCATION',
-            'login.staging.ubuntu.com'),
-        'sso_base_url': os.environ.get(
-            'SSO_BASE_URL',
-            'https://login.staging.ubuntu.com'),
-        'sca_base_url': os.environ.get(
-            'SCA_BASE_URL',
-            'http://0.0.0.0:8000'),
-        'api_base_url': os.environ.get(
-            'API_BASE_URL',
-            'http://0.0.0.0:8000'),
-    },
-    'staging': {
-        'sso_location': 'login.staging.ubuntu.com',
-        'sso_base_url': 'https://login.staging.ubuntu.com',
-        'sca_base_url': os.environ.get(
-            'SCA_ROOT_URL', 'https://dashboard.staging.snapcraft.io'),
-        'api_base_url': os.environ.get(
-            'API_ROOT_URL', 'https://api.staging.snapcraft.io'),
-
-    },
-    'production': {
-        'sso_location': 'login.ubuntu.com',
-        'sso_base_url': 'https://login.ubuntu.com',
-        'sca_base_url': 'https://dashboard.snapcraft.io',
-        'api_base_url': 'https://api.snapcraft.io',
-    },
-}
+
+
+@lru_cache()
+def get_constants() -> Dict[str, Dict[str, str]]:
+    """Return the store URLs of each environment.
+
+    Evaluated on first use rather than at import time so that the
+    environment variables overriding them are only read when needed.
+    """
+    return {
+        'local': {
+            'sso_location': os.environ.get(
+                'SSO_LOCATION',
+                'login.staging.ubuntu.com'),
+            'sso_base_url': os.environ.get(
+                'SSO_BASE_URL',
+                'https://login.staging.ubuntu.com'),
+            'sca_base_url': os.environ.get(
+                'SCA_BASE_URL',
+                'http://0.0.0.0:8000'),
+            'api_base_url': os.environ.get(
+                'API_BASE_URL',
+                'http://0.0.0.0:8000'),
+        },
+        'staging': {
+            'sso_location': 'login.staging.ubuntu.com',
+            'sso_base_url': 'https://login.staging.ubuntu.com',
+            'sca_base_url': os.environ.get(
+                'SCA_ROOT_URL', 'https://dashboard.staging.snapcraft.io'),
+            'api_base_url': os.environ.get(
+                'API_ROOT_URL', 'https://api.staging.snapcraft.io'),
+
+        },
+        'production': {
+            'sso_location': 'login.ubuntu.com',
+            'sso_base_url': 'https://login.ubuntu.com',
+            'sca_base_url': 'https://dashboard.snapcraft.io',
+            'api_base_url': 'https://api.snapcraft.io',
+        },
+    }
+
+
+def __getattr__(name: str) -> Any:
+    if name == 'CONSTANTS':
+        return get_constants()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
 DEFAULT_HEADERS = {
     'User-Agent': 'storeclient/{}'.format(
         os.environ.get('SNAP_VERSION', 'devel')),
@@ -74,7 +93,7 @@ DEFAULT_HEADERS = {
 
 
 def get_store_authorization(
-        session: Session,
+        session: 'Session',
         email: str,
         password: str,
         environment: str,
@@ -84,6 +103,8 @@ def get_store_authorization(
 
     Get a permissions macaroon from SCA and discharge it in SSO.
     """
+    from pymacaroons import Macaroon
+
     headers = DEFAULT_HEADERS.copy()
     # Request a SCA root macaroon with hard expiration in 180 days.
     sca_data = {
@@ -97,13 +118,13 @@ def get_store_authorization(
             'channels': channels
         })
     response = session.request(
-        url='{}/dev/api/acl/'.format(CONSTANTS[environment]['sca_base_url']),
+        url='{}/dev/api/acl/'.format(get_constants()[environment]['sca_base_url']),
         method='POST', json=sca_data, headers=headers)
     root = response.json()['macaroon']
 
     caveat, = [
         c for c in Macaroon.deserialize(root).third_party_caveats()
-        if c.location == CONSTANTS[environment]['sso_location']
+        if c.location == get_constants()[environment]['sso_location']
     ]
     # Request a SSO discharge macaroon.
     sso_data = {
@@ -113,7 +134,7 @@ def get_store_authorization(
     }
     response = session.request(
         url='{}/api/v2/tokens/discharge'.format(
-            CONSTANTS[environment]['sso_base_url']),
+            get_constants()[environment]['sso_base_url']),
         method='POST', json=sso_data, headers=headers)
     # OTP/2FA is optional.
     if (response.status_code == 401 and
@@ -122,7 +143,7 @@ def get_store_authorization(
         sso_data.update({'otp': input()})
         response = session.request(
             url='{}/api/v2/tokens/discharge'.format(
-                CONSTANTS[environment]['sso_base_url']),
+                get_constants()[environment]['sso_base_url']),
             method='POST', json=sso_data, headers=headers)
     discharge = response.json()['discharge_macaroon']
     return root, discharge
@@ -130,24 +151,142 @@ def get_store_authorization(
 
 def get_authorization_header(root: str, discharge: str) -> str:
     """Bind root and discharge returning the authorization header."""
+    from pymacaroons import Macaroon
+
     bound = Macaroon.deserialize(root).prepare_for_request(
         Macaroon.deserialize(discharge))
     return 'Macaroon root={}, discharge={}'.format(root, bound.serialize())
 
 
+class AuthCache:
+    """Thread-safe cache of authorization headers shared between clients.
+
+    Headers are keyed by environment, account, permissions and channels so
+    that only one SCA and SSO round-trip is made for each combination.
+    """
+
+    def __init__(self) -> None:
+        self._headers: Dict[Tuple, str] = {}
+        self._locks: Dict[Tuple, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple, fetch: Callable[[], str]) -> str:
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            header = self._headers.get(key)
+            if header is None:
+                header = self._headers[key] = fetch()
+            return header
+
+    def clear(self) -> None:
+        with self._lock:
+            self._headers.clear()
+
+
+class MediaCache:
+    """Thread-safe cache of binary metadata keyed by snap_id.
+
+    Every invalidation bumps a generation number for the snap. A fetch
+    that started before a write is then not stored, so a concurrent
+    reader cannot put stale metadata back into the cache.
+    """
+
+    def __init__(self) -> None:
+        self._metadata: Dict[str, List[Dict[str, str]]] = {}
+        self._generations: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def __contains__(self, snap_id: str) -> bool:
+        return snap_id in self._metadata
+
+    def generation(self, snap_id: str) -> int:
+        with self._lock:
+            return self._generations.get(snap_id, 0)
+
+    def get(self, snap_id: str) -> Optional[List[Dict[str, str]]]:
+        with self._lock:
+            metadata = self._metadata.get(snap_id)
+        if metadata is None:
+            return None
+        return [dict(item) for item in metadata]
+
+    def set(self,
+            snap_id: str,
+            metadata: List[Dict[str, str]],
+            generation: int) -> None:
+        with self._lock:
+            if self._generations.get(snap_id, 0) == generation:
+                self._metadata[snap_id] = [dict(item) for item in metadata]
+
+    def invalidate(self, snap_id: str) -> None:
+        with self._lock:
+            self._metadata.pop(snap_id, None)
+            self._generations[snap_id] = self._generations.get(snap_id, 0) + 1
+
+
 class Client:
     def __init__(self, *,
                  email: Optional[str] = None,
                  password: Optional[str] = None,
-                 environment: Optional[str] = 'production') -> None:
-        self.session = Session()
+                 environment: Optional[str] = 'production',
+                 auth_cache: Optional[AuthCache] = None,
+                 decoder: Optional[Decoder] = None,
+                 media_cache: Optional[MediaCache] = None) -> None:
+        self._session = None
+        self._decoder = decoder
         self.email = email
         self.password = password
         self.environment = environment
         self.channels = []
-        self.permissions = ALL_PERMISSIONS
+        self.permissions = list(ALL_PERMISSIONS)
+        self.auth_cache = auth_cache or AuthCache()
+        self.media_cache = media_cache or MediaCache()
+        self.request_count = 0
+
+    def clone(self) -> 'Client':
+        """Return a client with its own session sharing this one's caches."""
+        client = Client(email=self.email,
+                        password=self.password,
+                        environment=self.environment,
+                        auth_cache=self.auth_cache,
+                        decoder=self._decoder,
+                        media_cache=self.media_cache)
+        client.channels = list(self.channels)
+        client.permissions = list(self.permissions)
+        return client
+
+    @property
+    def session(self) -> 'Session':
+        if self._session is None:
+            from requests import Session
+            self._session = Session()
+        return self._session
+
+    @property
+    def decoder(self) -> Decoder:
+        if self._decoder is None:
+            self._decoder = get_decoder()
+        return self._decoder
+
+    def decode(self, r: 'Response') -> Any:
+        """Parse the JSON body of a response from its raw bytes."""
+        return self.decoder.decode(r.content)
+
+    def authorize(self) -> str:
+        """Return the authorization header, logging in if not cached yet.
+
+        Calling this before starting a batch of requests makes every
+        client sharing the auth cache reuse a single handshake.
+        """
+        return self._fetch_authorization_header()
 
     def _fetch_authorization_header(self):
+        key = (self.environment, self.email,
+               tuple(self.permissions), tuple(self.channels))
+        return self.auth_cache.get(key, self._authorize)
+
+    def _authorize(self) -> str:
         root, discharge = get_store_authorization(
             session=self.session,
             email=self.email,
@@ -159,9 +298,10 @@ class Client:
         return authorization
 
     @classmethod
-    @lru_cache()
     def get_default(cls) -> 'Client':
-        return Client()
+        """Return the default client of the calling thread."""
+        from storeclient.pool import ClientPool
+        return ClientPool.get_default().get()
 
     def _request(self,
                  base_url: str,
@@ -171,9 +311,10 @@ class Client:
                  headers: Optional[Dict[str, str]] = None,
                  data: Optional[HttpData] = None,
                  params: Optional[HttpData] = None,
-                 files: Optional[Dict[str, Any]] = None) -> Response:
+                 files: Optional[Dict[str, Any]] = None) -> 'Response':
         # import pprint
         # pprint.pprint(dict(method=method, url=url, headers=headers, data=data, params=params, files=files))
+        self.request_count += 1
         r = self.session.request(
             data=data,
             files=files,
@@ -186,21 +327,31 @@ class Client:
         # pprint.pprint(r.json())
         return r
 
-    def _api_request(self, *args, **kwargs) -> Response:
-        base_url = CONSTANTS[self.environment]['api_base_url']
-        print('BASE URL', base_url)
+    def _api_request(self, *args, **kwargs) -> 'Response':
+        base_url = get_constants()[self.environment]['api_base_url']
         return self._request(base_url, *args, **kwargs)
 
-    def _sca_request(self, *args, **kwargs) -> Response:
-        base_url = CONSTANTS[self.environment]['sca_base_url']
+    def _sca_request(self, *args, **kwargs) -> 'Response':
+        base_url = get_constants()[self.environment]['sca_base_url']
         return self._request(base_url, *args, **kwargs)
 
-    def snap_info(self, snap_name: str) -> Response:
+    def snap_info(self,
+                  snap_name: str,
+                  *,
+                  fields: Optional[List[str]] = None,
+                  etag: Optional[str] = None) -> 'Response':
+        headers = {'Snap-Device-Series': '16'}
+        if etag is not None:
+            headers['If-None-Match'] = etag
+        params: Dict[str, str] = {}
+        if fields is not None:
+            params['fields'] = ','.join(fields)
         return self._api_request(
             'GET', f'/v2/snaps/info/{snap_name}',
-            headers={'Snap-Device-Series': '16'})
+            headers=headers,
+            params=params)
 
-    def snap_names(self, architecture='amd64') -> Response:
+    def snap_names(self, architecture='amd64') -> 'Response':
         return self._api_request(
             'GET', f'/api/v1/snaps/names',
             headers={'X-Ubuntu-Series': '16',
@@ -219,7 +370,8 @@ class Client:
                *,
                fields: Optional[List[str]] = None,
                page: Optional[int] = None,
-               page_size: int = 100) -> Response:
+               page_size: int = 100,
+               delta_formats: Optional[List[str]] = None) -> 'Response':
         params: Dict[str, int] = {}
         if text is not None:
             params['q'] = text
@@ -229,13 +381,18 @@ class Client:
             params['page'] = page
         if page_size is not None:
             params['page_size'] = page_size
+        headers = {'X-Ubuntu-Series': '16',
+                   'X-Ubuntu-Architecture': 'amd64'}
+        if delta_formats:
+            headers['X-Ubuntu-Delta-Formats'] = ','.join(delta_formats)
         return self._api_request(
             'GET', f'/api/v1/snaps/search',
             params=params,
-            headers={'X-Ubuntu-Series': '16',
-                     'X-Ubuntu-Architecture': 'amd64'})
+            headers=headers)
 
     def _handle_error(self, r):
+        from requests import HTTPError
+
         try:
             r.raise_for_status()
         except HTTPError:
@@ -250,16 +407,33 @@ class Client:
                 print(f'ERROR: {r.status_code}: {error["message"]}')
                 extra = error.get('extra')
                 if extra:
+                    import pprint
                     pprint.pprint(extra)
 
     def get_binary_metadata(self, snap_id: str) -> List[Dict[str, str]]:
+        generation = self.media_cache.generation(snap_id)
         headers = DEFAULT_HEADERS.copy()
         headers['Authorization'] = self._fetch_authorization_header()
         r = self._sca_request(
             'GET', f'/dev/api/snaps/{snap_id}/binary-metadata',
             headers=headers,
         )
-        return r.json()
+        r.raise_for_status()
+        metadata = self.decode(r)
+        self.media_cache.set(snap_id, metadata, generation)
+        return metadata
+
+    def get_cached_binary_metadata(self,
+                                   snap_id: str) -> List[Dict[str, str]]:
+        """Like get_binary_metadata() but answered from the media cache.
+
+        Entries are dropped when this client, or one sharing its cache,
+        appends or clears the binary metadata of the snap.
+        """
+        metadata = self.media_cache.get(snap_id)
+        if metadata is None:
+            metadata = self.get_binary_metadata(snap_id)
+        return metadata
 
     def clear_binary_metadata(self, snap_id):
         headers = {
@@ -268,13 +442,16 @@ class Client:
             'Content-Type': 'multipart/form-data',
         }
 
-        r = self._sca_request(
-            'POST',
-            f'/dev/api/snaps/{snap_id}/binary-metadata',
-            data={'info': metadata},
-            headers=headers,
-            files={'icon': open('/dev/null')},
-        )
+        try:
+            r = self._sca_request(
+                'POST',
+                f'/dev/api/snaps/{snap_id}/binary-metadata',
+                data={'info': json.dumps([])},
+                headers=headers,
+                files={'icon': open('/dev/null')},
+            )
+        finally:
+            self.media_cache.invalidate(snap_id)
         self._handle_error(r)
         return r
 
@@ -282,6 +459,9 @@ class Client:
                               snap_id: str,
                               media_type: MediaType,
                               file: Union[str, BinaryIO]):
+        import hashlib
+        import mimetypes
+
         if isinstance(file, str):
             fp = open(file, 'rb')
             filename = file
@@ -307,13 +487,16 @@ class Client:
             'key': key,
             'filename': os.path.basename(filename),
         })
-        r = self._sca_request(
-            'POST',
-            f'/dev/api/snaps/{snap_id}/binary-metadata',
-            data={'info': json.dumps(metadata)},
-            headers=headers,
-            files=[(key, (filename, fp, mime_type))],
-        )
+        try:
+            r = self._sca_request(
+                'POST',
+                f'/dev/api/snaps/{snap_id}/binary-metadata',
+                data={'info': json.dumps(metadata)},
+                headers=headers,
+                files=[(key, (filename, fp, mime_type))],
+            )
+        finally:
+            self.media_cache.invalidate(snap_id)
         self._handle_error(r)
 
         return r
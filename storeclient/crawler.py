@@ -0,0 +1,157 @@
+"""Crawl the whole store catalogue using a pool of worker processes.
+
+Page ranges are sharded across processes, each with its own Client. Every
+completed page is written atomically to its own file in the output
+directory, which doubles as the checkpoint: restarting a crawl only
+fetches the pages that have no file yet.
+"""
+import argparse
+import datetime
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import astuple, fields
+from typing import Iterator, List, Optional, Sequence, Set, Tuple
+
+from storeclient.client import Client
+from storeclient.exceptions import StoreError
+from storeclient.store import SearchInfo, parse_url_query
+
+PAGE_SIZE = 100
+SEARCH_INFO_FIELDS = [field.name for field in fields(SearchInfo)]
+DATETIME_FIELDS = {'date_published'}
+
+_client: Optional[Client] = None
+
+
+def encode_rows(infos: List[SearchInfo]) -> bytes:
+    """Serialise rows as JSON arrays in SearchInfo field order."""
+    return b''.join(
+        json.dumps(astuple(info), default=_encode_default,
+                   separators=(',', ':')).encode() + b'\n'
+        for info in infos)
+
+
+def _encode_default(value):
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    raise TypeError(f'Cannot serialise {type(value).__name__}')
+
+
+def decode_rows(data: bytes) -> Iterator[SearchInfo]:
+    for line in data.splitlines():
+        row = dict(zip(SEARCH_INFO_FIELDS, json.loads(line)))
+        for name in DATETIME_FIELDS:
+            if row[name] is not None:
+                row[name] = datetime.datetime.fromisoformat(row[name])
+        yield SearchInfo(**row)
+
+
+def _page_filename(directory: str, page: int) -> str:
+    return os.path.join(directory, f'page-{page:06d}.jsonl')
+
+
+def completed_pages(directory: str) -> Set[int]:
+    pages = set()
+    for filename in os.listdir(directory):
+        if filename.startswith('page-') and filename.endswith('.jsonl'):
+            pages.add(int(filename[5:-6]))
+    return pages
+
+
+def count_pages(client: Client, text: Optional[str] = None) -> int:
+    r = client.search(text=text, page=1, page_size=PAGE_SIZE)
+    r.raise_for_status()
+    links = client.decode(r)['_links']
+    last = links.get('last')
+    if last is None:
+        if links.get('next') is not None:
+            raise StoreError(
+                'Search response does not link to the last page')
+        return 1
+    return int(parse_url_query(last['href']).get('page', 1))
+
+
+def shard_pages(pages: Sequence[int], shard_size: int) -> List[List[int]]:
+    return [list(pages[i:i + shard_size])
+            for i in range(0, len(pages), shard_size)]
+
+
+def _init_worker(environment: str) -> None:
+    global _client
+    _client = Client(environment=environment)
+
+
+def _crawl_shard(directory: str,
+                 text: Optional[str],
+                 pages: List[int]) -> List[Tuple[int, int]]:
+    """Fetch and store each page of a shard, returning (page, rows) pairs."""
+    done = []
+    for page in pages:
+        r = _client.search(text=text, page=page, page_size=PAGE_SIZE)
+        r.raise_for_status()
+        rows = _client.decode(r)['_embedded']['clickindex:package']
+        infos = [SearchInfo.from_json(row) for row in rows]
+        filename = _page_filename(directory, page)
+        with open(filename + '.tmp', 'wb') as f:
+            f.write(encode_rows(infos))
+        os.replace(filename + '.tmp', filename)
+        done.append((page, len(infos)))
+    return done
+
+
+def crawl(directory: str,
+          *,
+          text: Optional[str] = None,
+          environment: str = 'production',
+          workers: Optional[int] = None,
+          shard_size: int = 10,
+          client: Optional[Client] = None) -> int:
+    """Crawl all missing search pages into directory.
+
+    Returns the number of rows fetched by this run.
+    """
+    os.makedirs(directory, exist_ok=True)
+    client = client or Client(environment=environment)
+    total = count_pages(client, text=text)
+    done = completed_pages(directory)
+    missing = [page for page in range(1, total + 1) if page not in done]
+    rows = 0
+    if not missing:
+        return rows
+    with ProcessPoolExecutor(max_workers=workers,
+                             initializer=_init_worker,
+                             initargs=(environment,)) as executor:
+        futures = [executor.submit(_crawl_shard, directory, text, shard)
+                   for shard in shard_pages(missing, shard_size)]
+        for future in as_completed(futures):
+            for page, count in future.result():
+                rows += count
+    return rows
+
+
+def load(directory: str) -> Iterator[SearchInfo]:
+    """Iterate over the rows of a crawl in page order."""
+    for page in sorted(completed_pages(directory)):
+        with open(_page_filename(directory, page), 'rb') as f:
+            yield from decode_rows(f.read())
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('directory')
+    parser.add_argument('-q', '--query', default=None)
+    parser.add_argument('-e', '--environment', default='production')
+    parser.add_argument('-j', '--workers', type=int, default=None)
+    parser.add_argument('--shard-size', type=int, default=10)
+    args = parser.parse_args(argv)
+    rows = crawl(args.directory,
+                 text=args.query,
+                 environment=args.environment,
+                 workers=args.workers,
+                 shard_size=args.shard_size)
+    print(f'Fetched {rows} rows into {args.directory}')
+
+
+if __name__ == '__main__':
+    main()
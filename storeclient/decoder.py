@@ -0,0 +1,62 @@
+"""JSON decoders for store responses.
+
+Decoders parse the raw response body, skipping the bytes to str decoding
+that Response.json() does. orjson or msgspec are used when installed and
+the standard library json module otherwise. The STORECLIENT_JSON
+environment variable selects a backend by name.
+"""
+import json
+import os
+from typing import Any, Dict, Optional, Type
+
+
+class Decoder:
+    name = 'json'
+
+    def decode(self, data: bytes) -> Any:
+        return json.loads(data)
+
+
+class OrjsonDecoder(Decoder):
+    name = 'orjson'
+
+    def __init__(self) -> None:
+        import orjson
+        self._loads = orjson.loads
+
+    def decode(self, data: bytes) -> Any:
+        return self._loads(data)
+
+
+class MsgspecDecoder(Decoder):
+    name = 'msgspec'
+
+    def __init__(self) -> None:
+        import msgspec
+        self._decoder = msgspec.json.Decoder()
+
+    def decode(self, data: bytes) -> Any:
+        return self._decoder.decode(data)
+
+
+DECODERS: Dict[str, Type[Decoder]] = {
+    OrjsonDecoder.name: OrjsonDecoder,
+    MsgspecDecoder.name: MsgspecDecoder,
+    Decoder.name: Decoder,
+}
+
+
+def get_decoder(name: Optional[str] = None) -> Decoder:
+    """Return the named decoder, or the fastest one that is installed."""
+    name = name or os.environ.get('STORECLIENT_JSON')
+    if name is not None:
+        try:
+            return DECODERS[name]()
+        except KeyError:
+            raise ValueError(f'Unknown JSON decoder: {name}')
+    for decoder_class in DECODERS.values():
+        try:
+            return decoder_class()
+        except ImportError:
+            continue
+    return Decoder()
@@ -0,0 +1,158 @@
+"""Update cached snaps using the deltas offered by the store.
+
+Search with delta_formats=list(DELTA_APPLIERS) to have the store fill in
+SearchInfo.deltas. Each delta is a dict describing how to go from one
+revision to another::
+
+    {'from_revision': 10, 'to_revision': 11, 'format': 'xdelta3',
+     'download_url': '...', 'binary_filesize': 1234}
+"""
+import glob
+import os
+import re
+import subprocess
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from storeclient.store import SearchInfo, download_file
+
+# Called with the source snap, the delta and the target file to write.
+DeltaApplier = Callable[[str, str, str], None]
+
+
+def apply_xdelta3(source: str, delta: str, target: str) -> None:
+    subprocess.run(['xdelta3', '-d', '-f', '-s', source, delta, target],
+                   check=True)
+
+
+DELTA_APPLIERS: Dict[str, DeltaApplier] = {
+    'xdelta3': apply_xdelta3,
+}
+
+
+@dataclass
+class UpdateResult:
+    filename: str
+    revision: int
+    used_delta: bool
+    bytes_downloaded: int
+    bytes_saved: int
+    # Why an offered delta was not used, None if there was none to try.
+    fallback_reason: Optional[str] = None
+
+
+def cached_revision(cache_dir: str, name: str) -> Optional[Tuple[int, str]]:
+    """Return the newest cached revision of a snap and its filename."""
+    pattern = re.compile(re.escape(name) + r'_(\d+)\.snap$')
+    newest = None
+    for filename in glob.glob(os.path.join(cache_dir, f'{name}_*.snap')):
+        match = pattern.search(os.path.basename(filename))
+        if match is None:
+            continue
+        revision = int(match.group(1))
+        if newest is None or revision > newest[0]:
+            newest = (revision, filename)
+    return newest
+
+
+def find_delta(info: SearchInfo,
+               from_revision: int,
+               appliers: Dict[str, DeltaApplier]) -> Optional[Dict[str, Any]]:
+    for delta in info.deltas or []:
+        if (delta.get('from_revision') == from_revision and
+                delta.get('to_revision') == info.revision and
+                delta.get('format') in appliers):
+            return delta
+    return None
+
+
+def apply_delta_update(info: SearchInfo,
+                       delta: Dict[str, Any],
+                       source: str,
+                       filename: str,
+                       appliers: Dict[str, DeltaApplier]) -> int:
+    """Download delta and apply it to source, returning the delta size.
+
+    Raises ValueError if the result does not match download_sha3_384.
+    """
+    import hashlib
+
+    delta_filename = filename + '.delta'
+    url = delta.get('download_url') or delta['anon_download_url']
+    try:
+        size, _ = download_file(url, delta_filename)
+        appliers[delta['format']](source, delta_filename, filename)
+    finally:
+        if os.path.exists(delta_filename):
+            os.remove(delta_filename)
+
+    sha = hashlib.sha3_384()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(64 * 1024), b''):
+            sha.update(block)
+    if sha.hexdigest() != info.download_sha3_384:
+        os.remove(filename)
+        raise ValueError("Hash failed")
+    return size
+
+
+def update(info: SearchInfo,
+           cache_dir: str,
+           *,
+           appliers: Optional[Dict[str, DeltaApplier]] = None,
+           keep_previous: bool = False) -> UpdateResult:
+    """Bring the cached copy of a snap up to info.revision.
+
+    A delta from the newest cached revision is used when the store offers
+    one in a supported format, falling back to a full download when there
+    is none or when fetching, applying or verifying it fails. The reason
+    for falling back is kept in UpdateResult.fallback_reason.
+    """
+    appliers = DELTA_APPLIERS if appliers is None else appliers
+    name = info.package_name
+    filename = os.path.join(cache_dir, f'{name}_{info.revision}.snap')
+    if os.path.exists(filename):
+        return UpdateResult(filename, info.revision, used_delta=False,
+                            bytes_downloaded=0,
+                            bytes_saved=info.binary_filesize or 0)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    partial = filename + '.part'
+    result = None
+    fallback_reason = None
+    cached = cached_revision(cache_dir, name)
+    if cached is not None:
+        revision, source = cached
+        delta = find_delta(info, revision, appliers)
+        if delta is not None:
+            try:
+                size = apply_delta_update(info, delta, source, partial,
+                                          appliers)
+            except Exception as e:
+                # Any failure of the delta path, including errors raised
+                # by a pluggable applier, falls back to a full download.
+                fallback_reason = f'{type(e).__name__}: {e}'
+            else:
+                result = UpdateResult(
+                    filename, info.revision, used_delta=True,
+                    bytes_downloaded=size,
+                    bytes_saved=max(0, (info.binary_filesize or 0) - size))
+
+    if result is None:
+        try:
+            size = info.download(partial)
+        except BaseException:
+            if os.path.exists(partial):
+                os.remove(partial)
+            raise
+        result = UpdateResult(filename, info.revision, used_delta=False,
+                              bytes_downloaded=size, bytes_saved=0,
+                              fallback_reason=fallback_reason)
+
+    os.replace(partial, filename)
+    # After a rollback the cached revision is newer than the one fetched,
+    # keep it as it may be released again.
+    if (cached is not None and not keep_previous and
+            cached[0] < info.revision):
+        os.remove(cached[1])
+    return result
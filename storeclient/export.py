@@ -0,0 +1,254 @@
+import csv
+import io
+import json
+import os
+import threading
+import urllib.parse
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import asdict, dataclass, fields
+from typing import BinaryIO, Dict, Iterator, List, Optional, Set, Tuple
+
+from storeclient.store import SearchInfo, Store
+
+
+@dataclass
+class MediaRef:
+    page: int
+    snap_name: str
+    media_type: str
+    url: str
+
+
+MEDIA_REF_FIELDS = [field.name for field in fields(MediaRef)]
+
+
+def iter_media_refs(page: int, info: SearchInfo) -> Iterator[MediaRef]:
+    if info.icon_url:
+        yield MediaRef(page=page,
+                       snap_name=info.package_name,
+                       media_type='icon',
+                       url=info.icon_url)
+    for screenshot in info.screenshot_urls or []:
+        yield MediaRef(page=page,
+                       snap_name=info.package_name,
+                       media_type='screenshot',
+                       url=screenshot)
+
+
+class JSONLinesWriter:
+    """Write one JSON object per media reference."""
+
+    def __init__(self, fp: BinaryIO) -> None:
+        self.fp = fp
+
+    def write(self, refs: List[MediaRef]) -> None:
+        self.fp.write(b''.join(
+            json.dumps(asdict(ref)).encode() + b'\n' for ref in refs))
+
+
+class CSVWriter:
+    """Write media references as CSV rows, with a header for new files."""
+
+    def __init__(self, fp: BinaryIO) -> None:
+        self.fp = fp
+        if fp.tell() == 0:
+            self._write_rows([MEDIA_REF_FIELDS])
+
+    def _write_rows(self, rows: List[List]) -> None:
+        buf = io.StringIO()
+        csv.writer(buf).writerows(rows)
+        self.fp.write(buf.getvalue().encode())
+
+    def write(self, refs: List[MediaRef]) -> None:
+        self._write_rows([[getattr(ref, name) for name in MEDIA_REF_FIELDS]
+                          for ref in refs])
+
+
+class ColumnarWriter:
+    """Write each batch of media references as one JSON object of columns.
+
+    Every line holds a column per MediaRef field, which keeps repeated
+    values such as page and media_type cheap to scan and compress.
+    """
+
+    def __init__(self, fp: BinaryIO) -> None:
+        self.fp = fp
+
+    def write(self, refs: List[MediaRef]) -> None:
+        if not refs:
+            return
+        columns = {name: [getattr(ref, name) for ref in refs]
+                   for name in MEDIA_REF_FIELDS}
+        self.fp.write(json.dumps(columns).encode() + b'\n')
+
+
+WRITERS = {
+    'jsonl': JSONLinesWriter,
+    'csv': CSVWriter,
+    'columnar': ColumnarWriter,
+}
+
+
+@dataclass
+class Checkpoint:
+    """Last search page fully written to the output and its file offset."""
+    page: int = 0
+    offset: int = 0
+    rows: int = 0
+    complete: bool = False
+
+    @classmethod
+    def load(cls, filename: str) -> 'Checkpoint':
+        if not os.path.exists(filename):
+            return cls()
+        with open(filename, 'rt') as f:
+            return cls(**json.load(f))
+
+    def save(self, filename: str) -> None:
+        tmp = filename + '.tmp'
+        with open(tmp, 'wt') as f:
+            json.dump(asdict(self), f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, filename)
+
+
+class MediaDownloader:
+    """Download media files concurrently, fetching each URL only once.
+
+    A failed download does not stop the others, its exception is recorded
+    in failures by wait() and close().
+    """
+
+    def __init__(self,
+                 directory: str,
+                 workers: int = 8,
+                 timeout: float = 60) -> None:
+        self.directory = directory
+        self.timeout = timeout
+        self.failures: Dict[str, Exception] = {}
+        self._executor = ThreadPoolExecutor(max_workers=workers)
+        self._seen: Set[str] = set()
+        self._lock = threading.Lock()
+        self._futures: List[Tuple[str, Future]] = []
+        os.makedirs(directory, exist_ok=True)
+
+    def __enter__(self) -> 'MediaDownloader':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def local_path(self, url: str) -> str:
+        """Return a file name unique to url, keeping its extension.
+
+        Media of different snaps often share a basename such as icon.png,
+        so the name is derived from a hash of the whole URL.
+        """
+        import hashlib
+
+        path = urllib.parse.urlparse(url).path
+        extension = os.path.splitext(path)[1]
+        digest = hashlib.sha256(url.encode()).hexdigest()
+        return os.path.join(self.directory, digest + extension)
+
+    def submit(self, url: str) -> Optional[Future]:
+        with self._lock:
+            if url in self._seen:
+                return None
+            self._seen.add(url)
+        future = self._executor.submit(self._download, url)
+        with self._lock:
+            self._futures.append((url, future))
+        return future
+
+    def _download(self, url: str) -> str:
+        import requests
+
+        local = self.local_path(url)
+        if os.path.exists(local):
+            return local
+        r = requests.get(url, stream=True, timeout=self.timeout)
+        r.raise_for_status()
+        tmp = local + '.part'
+        with open(tmp, 'wb') as f:
+            for chunk in r.iter_content(chunk_size=64 * 1024):
+                f.write(chunk)
+        os.replace(tmp, local)
+        return local
+
+    def wait(self) -> None:
+        """Wait for every download submitted so far to finish."""
+        with self._lock:
+            futures, self._futures = self._futures, []
+        for url, future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                self.failures[url] = e
+
+    def close(self) -> None:
+        self.wait()
+        self._executor.shutdown(wait=True)
+
+
+def export_media(store: Store,
+                 filename: str,
+                 *,
+                 format: str = 'jsonl',
+                 checkpoint: Optional[str] = None,
+                 checkpoint_every: int = 1,
+                 text: Optional[str] = None,
+                 downloader: Optional[MediaDownloader] = None) -> Checkpoint:
+    """Export icon and screenshot URLs of the whole catalogue.
+
+    Rows are buffered and flushed every checkpoint_every pages, after which
+    the checkpoint file is updated. When the checkpoint exists, the output
+    is truncated to the last checkpointed offset and the search resumes
+    from the following page.
+
+    With a downloader, the media of a page are downloaded before the page
+    is checkpointed, so a resumed export does not miss any of them.
+    """
+    try:
+        writer_class = WRITERS[format]
+    except KeyError:
+        raise ValueError(f'Unknown export format: {format}')
+    if checkpoint is None:
+        checkpoint = filename + '.checkpoint'
+    state = Checkpoint.load(checkpoint)
+    if state.complete:
+        return state
+
+    mode = 'r+b' if os.path.exists(filename) else 'w+b'
+    with open(filename, mode, buffering=1024 * 1024) as fp:
+        fp.seek(state.offset)
+        fp.truncate()
+        writer = writer_class(fp)
+        pending = 0
+        for page, infos in store.search_pages(
+                text=text, start_page=state.page + 1 if state.page else None):
+            refs = [ref for info in infos for ref in iter_media_refs(page, info)]
+            writer.write(refs)
+            if downloader is not None:
+                for ref in refs:
+                    downloader.submit(ref.url)
+            state.rows += len(refs)
+            state.page = page
+            pending += 1
+            if pending >= checkpoint_every:
+                if downloader is not None:
+                    downloader.wait()
+                fp.flush()
+                os.fsync(fp.fileno())
+                state.offset = fp.tell()
+                state.save(checkpoint)
+                pending = 0
+        if downloader is not None:
+            downloader.wait()
+        fp.flush()
+        os.fsync(fp.fileno())
+        state.offset = fp.tell()
+        state.complete = True
+        state.save(checkpoint)
+    return state
@@ -0,0 +1,282 @@
+"""Append-only, column-oriented history of snap channel maps.
+
+Each column lives in its own flat binary file in the history directory
+and is memory-mapped for queries. Snap names, tracks and architectures
+are dictionary encoded into int32 codes, risks into int8 and timestamps
+are int64 microseconds since the epoch, so filters and aggregates run as
+array operations without building Channel objects.
+
+Several ChannelHistory instances, in one or more processes, may share a
+directory: appends hold a file lock and queries pick up rows appended by
+others.
+
+Requires numpy, install storeclient[history].
+"""
+import datetime
+import fcntl
+import json
+import os
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+from storeclient.channel import Channel
+from storeclient.enums import RiskType
+from storeclient.snap import Snap
+
+COLUMNS = {
+    'snapshot_at': np.int64,
+    'snap': np.int32,
+    'track': np.int32,
+    'architecture': np.int32,
+    'risk': np.int8,
+    'revision': np.int64,
+    'size': np.int64,
+    'released_at': np.int64,
+    'sha3_384': np.dtype((np.uint8, 48)),
+}
+DICTIONARY_COLUMNS = ['snap', 'track', 'architecture']
+RISKS = list(RiskType)
+MISSING_TIME = np.iinfo(np.int64).min
+EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def to_timestamp(dt: Optional[datetime.datetime]) -> int:
+    if dt is None:
+        return MISSING_TIME
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return (dt - EPOCH) // datetime.timedelta(microseconds=1)
+
+
+def from_timestamp(value: int) -> Optional[datetime.datetime]:
+    if value == MISSING_TIME:
+        return None
+    return EPOCH + datetime.timedelta(microseconds=int(value))
+
+
+class ChannelHistory:
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self._load_dictionaries()
+        self._columns: Optional[Dict[str, np.ndarray]] = None
+        self._length = 0
+
+    def __repr__(self) -> str:
+        return f'<{type(self).__name__}: {len(self)} rows>'
+
+    def __len__(self) -> int:
+        # A crash while appending can leave some columns longer than
+        # others, only rows present in every column count.
+        return min(self._stored_rows(name, dtype)
+                   for name, dtype in COLUMNS.items())
+
+    def _stored_rows(self, name: str, dtype: np.dtype) -> int:
+        path = self._path(name)
+        if not os.path.exists(path):
+            return 0
+        return os.path.getsize(path) // np.dtype(dtype).itemsize
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _load_dictionaries(self) -> None:
+        self._dictionaries: Dict[str, List[str]] = {
+            name: [] for name in DICTIONARY_COLUMNS}
+        path = self._path('dictionaries.json')
+        if os.path.exists(path):
+            with open(path, 'rt') as f:
+                self._dictionaries.update(json.load(f))
+        self._codes = {
+            name: {value: code for code, value in enumerate(values)}
+            for name, values in self._dictionaries.items()}
+
+    def _encode(self, name: str, value: str) -> int:
+        codes = self._codes[name]
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(self._dictionaries[name])
+            self._dictionaries[name].append(value)
+        return code
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """Hold an exclusive lock on the directory across processes."""
+        with open(self._path('lock'), 'wb') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _save_dictionaries(self) -> None:
+        path = self._path('dictionaries.json')
+        with open(path + '.tmp', 'wt') as f:
+            json.dump(self._dictionaries, f)
+        os.replace(path + '.tmp', path)
+
+    def append(self,
+               snap: str,
+               channels: Iterable[Channel],
+               snapshot_at: Optional[datetime.datetime] = None) -> int:
+        """Append a snapshot of the channels of a snap, returning its size."""
+        channels = list(channels)
+        if not channels:
+            return 0
+        if snapshot_at is None:
+            snapshot_at = datetime.datetime.now(datetime.timezone.utc)
+        digests = [bytes.fromhex(c.sha3_384 or '') for c in channels]
+        for channel, digest in zip(channels, digests):
+            if len(digest) != COLUMNS['sha3_384'].itemsize:
+                raise ValueError(
+                    f'Invalid sha3_384 for {snap} revision '
+                    f'{channel.revision}: {channel.sha3_384!r}')
+        rows = len(channels)
+        with self._locked():
+            # Another instance may have appended since the dictionaries
+            # were loaded, encode with its values so none are overwritten.
+            self._load_dictionaries()
+            length = len(self)
+            values = {
+                'snapshot_at': [to_timestamp(snapshot_at)] * rows,
+                'snap': [self._encode('snap', snap)] * rows,
+                'track': [self._encode('track', c.track) for c in channels],
+                'architecture': [self._encode('architecture', c.architecture)
+                                 for c in channels],
+                'risk': [RISKS.index(c.risk) for c in channels],
+                'revision': [c.revision for c in channels],
+                'size': [c.size for c in channels],
+                'released_at': [to_timestamp(c.released_at)
+                                for c in channels],
+                'sha3_384': np.frombuffer(b''.join(digests), dtype=np.uint8),
+            }
+            # Dictionaries are written first so every stored code resolves.
+            self._save_dictionaries()
+            for name, dtype in COLUMNS.items():
+                with open(self._path(name), 'ab') as f:
+                    f.truncate(length * np.dtype(dtype).itemsize)
+                    np.asarray(values[name],
+                               dtype=np.dtype(dtype).base).tofile(f)
+        self._columns = None
+        return rows
+
+    def append_snap(self,
+                    snap: Snap,
+                    snapshot_at: Optional[datetime.datetime] = None) -> int:
+        return self.append(snap.name, snap.channels, snapshot_at)
+
+    def _snapshot(self) -> Dict[str, np.ndarray]:
+        """Return memory maps of all columns with the same length.
+
+        The maps and dictionaries are reloaded when the stored length
+        changed, so rows and values appended by another ChannelHistory on
+        the same directory become visible.
+        """
+        length = len(self)
+        if self._columns is None or length != self._length:
+            self._load_dictionaries()
+            self._columns = {}
+            for column, dtype in COLUMNS.items():
+                if length:
+                    self._columns[column] = np.memmap(
+                        self._path(column), dtype=dtype, mode='r',
+                        shape=(length,))
+                else:
+                    self._columns[column] = np.empty(0, dtype=dtype)
+            self._length = length
+        return self._columns
+
+    def column(self, name: str) -> np.ndarray:
+        """Return a read-only memory map of a column."""
+        return self._snapshot()[name]
+
+    def select(self, *,
+               snap: Optional[str] = None,
+               track: Optional[str] = None,
+               risk: Optional[RiskType] = None,
+               architecture: Optional[str] = None,
+               since: Optional[datetime.datetime] = None,
+               until: Optional[datetime.datetime] = None,
+               time_column: str = 'released_at') -> np.ndarray:
+        """Return the indices of the rows matching every given filter.
+
+        since and until bound time_column, which is released_at by
+        default and may be snapshot_at.
+        """
+        columns = self._snapshot()
+        mask = np.ones(self._length, dtype=bool)
+        for name, value in (('snap', snap),
+                            ('track', track),
+                            ('architecture', architecture)):
+            if value is None:
+                continue
+            code = self._codes[name].get(value)
+            if code is None:
+                return np.empty(0, dtype=np.int64)
+            mask &= columns[name] == code
+        if risk is not None:
+            if type(risk) == str:
+                risk = RiskType[risk]
+            mask &= columns['risk'] == RISKS.index(risk)
+        if since is not None or until is not None:
+            times = columns[time_column]
+            mask &= times != MISSING_TIME
+            if since is not None:
+                mask &= times >= to_timestamp(since)
+            if until is not None:
+                mask &= times < to_timestamp(until)
+        return np.flatnonzero(mask)
+
+    def releases(self, indices: Optional[np.ndarray] = None) -> np.ndarray:
+        """Reduce rows to the first snapshot of every distinct release.
+
+        A release is identified by snap, track, risk, architecture and
+        revision; later snapshots of an unchanged channel are dropped.
+        """
+        columns = self._snapshot()
+        if indices is None:
+            indices = np.arange(self._length)
+        keys = np.stack([columns[name][indices].astype(np.int64)
+                         for name in ('snap', 'track', 'risk',
+                                      'architecture', 'revision')], axis=1)
+        _, first = np.unique(keys, axis=0, return_index=True)
+        return indices[np.sort(first)]
+
+    def size_stats(self, indices: np.ndarray) -> Dict[str, float]:
+        sizes = self.column('size')[indices]
+        if not len(sizes):
+            return {'count': 0, 'total': 0, 'mean': 0.0, 'max': 0}
+        return {
+            'count': int(len(sizes)),
+            'total': int(sizes.sum()),
+            'mean': float(sizes.mean()),
+            'max': int(sizes.max()),
+        }
+
+    def count_by(self, name: str, indices: np.ndarray) -> Dict[str, int]:
+        """Count rows per snap, track or architecture."""
+        column = self.column(name)
+        counts = np.bincount(column[indices],
+                             minlength=len(self._dictionaries[name]))
+        return {self._dictionaries[name][code]: int(count)
+                for code, count in enumerate(counts) if count}
+
+    def rows(self, indices: np.ndarray) -> Iterator[Dict[str, object]]:
+        """Decode rows back into dicts, for display."""
+        columns = self._snapshot()
+        dictionaries = self._dictionaries
+        for i in indices:
+            yield {
+                'snapshot_at': from_timestamp(columns['snapshot_at'][i]),
+                'snap': dictionaries['snap'][columns['snap'][i]],
+                'track': dictionaries['track'][columns['track'][i]],
+                'architecture': dictionaries['architecture'][
+                    columns['architecture'][i]],
+                'risk': RISKS[columns['risk'][i]],
+                'revision': int(columns['revision'][i]),
+                'size': int(columns['size'][i]),
+                'released_at': from_timestamp(columns['released_at'][i]),
+                'sha3_384': columns['sha3_384'][i].tobytes().hex(),
+            }
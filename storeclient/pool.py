@@ -0,0 +1,131 @@
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Iterator, List, Optional
+
+from storeclient.client import ALL_PERMISSIONS, AuthCache, Client, MediaCache
+
+
+@dataclass
+class LeaseStats:
+    requests: int = 0
+    seconds: float = 0.0
+
+
+@dataclass
+class PoolStats:
+    created: int = 0
+    leases: int = 0
+    requests: int = 0
+    seconds: float = 0.0
+
+
+@dataclass
+class Lease:
+    client: Client
+    stats: LeaseStats = field(default_factory=LeaseStats)
+
+
+class ClientPool:
+    """Hand out Client instances that are never shared between threads.
+
+    All clients of a pool use the same account and environment and share
+    an AuthCache and a MediaCache, but each has its own requests session
+    and its own channels and permissions lists. get() returns a client
+    bound to the calling thread, lease() lends an idle client for the
+    duration of a with block. Leased clients get the channels and
+    permissions of the pool back when they are returned, so changes made
+    by one lessee are not seen by the next.
+    """
+
+    def __init__(self, *,
+                 email: Optional[str] = None,
+                 password: Optional[str] = None,
+                 environment: str = 'production',
+                 permissions: Optional[List[str]] = None,
+                 channels: Optional[List[str]] = None,
+                 auth_cache: Optional[AuthCache] = None,
+                 media_cache: Optional[MediaCache] = None,
+                 max_idle: int = 16) -> None:
+        self.email = email
+        self.password = password
+        self.environment = environment
+        self.permissions = list(ALL_PERMISSIONS if permissions is None
+                                else permissions)
+        self.channels = list(channels or [])
+        self.max_idle = max_idle
+        self.auth_cache = auth_cache or AuthCache()
+        self.media_cache = media_cache or MediaCache()
+        self.stats = PoolStats()
+        self._idle: List[Client] = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @classmethod
+    def for_client(cls, client: Client) -> 'ClientPool':
+        """Return a pool of clients like client, sharing its caches."""
+        return cls(email=client.email,
+                   password=client.password,
+                   environment=client.environment,
+                   permissions=client.permissions,
+                   channels=client.channels,
+                   auth_cache=client.auth_cache,
+                   media_cache=client.media_cache)
+
+    @classmethod
+    def get_default(cls) -> 'ClientPool':
+        global _default_pool
+        with _default_lock:
+            if _default_pool is None:
+                _default_pool = ClientPool()
+            return _default_pool
+
+    def _reset(self, client: Client) -> None:
+        client.permissions = list(self.permissions)
+        client.channels = list(self.channels)
+
+    def _new_client(self) -> Client:
+        with self._lock:
+            self.stats.created += 1
+        client = Client(email=self.email,
+                        password=self.password,
+                        environment=self.environment,
+                        auth_cache=self.auth_cache,
+                        media_cache=self.media_cache)
+        self._reset(client)
+        return client
+
+    def get(self) -> Client:
+        """Return the client of the calling thread, creating it if needed."""
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self._new_client()
+        return client
+
+    @contextmanager
+    def lease(self) -> Iterator[Lease]:
+        """Lend a client exclusively to the caller until the block exits."""
+        with self._lock:
+            client = self._idle.pop() if self._idle else None
+        if client is None:
+            client = self._new_client()
+        lease = Lease(client)
+        requests = client.request_count
+        started = time.monotonic()
+        try:
+            yield lease
+        finally:
+            lease.stats.requests = client.request_count - requests
+            lease.stats.seconds = time.monotonic() - started
+            self._reset(client)
+            with self._lock:
+                self.stats.leases += 1
+                self.stats.requests += lease.stats.requests
+                self.stats.seconds += lease.stats.seconds
+                if len(self._idle) < self.max_idle:
+                    self._idle.append(client)
+
+
+_default_pool: Optional[ClientPool] = None
+_default_lock = threading.Lock()
@@ -1,8 +1,8 @@
 from dataclasses import dataclass
-from typing import Dict, Any
+from typing import Any, Dict, List
 
 from storeclient.channels import Channels
-from storeclient.store import Client
+from storeclient.client import Client
 
 
 @dataclass
@@ -19,7 +19,5 @@ class Snap:
     def channels(self) -> Channels:
         return Channels.from_channel_maps(self._data['channel-map'])
 
-    def media(self):
-        r = self._client.get_binary_metadata(self.id)
-        r.raise_for_status()
-        return r.json()
+    def media(self) -> List[Dict[str, str]]:
+        return self._client.get_binary_metadata(self.id)
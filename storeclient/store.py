@@ -1,13 +1,13 @@
 import datetime
-import hashlib
 import urllib.parse
+from contextlib import contextmanager
 from dataclasses import dataclass
-from typing import Any, Dict, List, Optional
-
-import requests
+from typing import (Any, Dict, Iterable, Iterator, List, Optional, Tuple,
+                    Union)
 
 from storeclient.client import Client
 from storeclient.dateutils import parse_datetime
+from storeclient.pool import ClientPool
 from storeclient.snap import Snap
 
 
@@ -16,6 +16,27 @@ def parse_url_query(url: str) -> Dict[str, str]:
     return dict(urllib.parse.parse_qsl(parts.query))
 
 
+def download_file(url: str, filename: str) -> Tuple[int, str]:
+    """Stream url to filename, returning its size and sha3-384 digest."""
+    import hashlib
+    import requests
+
+    r = requests.get(url, stream=True)
+    r.raise_for_status()
+    sha = hashlib.sha3_384()
+    size = 0
+    BLOCKSIZE = 16 * 1024
+    with open(filename, 'wb') as f:
+        while True:
+            file_buffer = r.raw.read(BLOCKSIZE)
+            if not file_buffer:
+                break
+            f.write(file_buffer)
+            sha.update(file_buffer)
+            size += len(file_buffer)
+    return size, sha.hexdigest()
+
+
 @dataclass
 class SearchInfo:
     aliases: List[Optional[str]]
@@ -29,7 +50,7 @@ class SearchInfo:
     contact: Optional[str]
     content: Optional[str]
     date_published: datetime.datetime
-    deltas: Optional[List[str]]  # ?
+    deltas: Optional[List[Dict[str, Any]]]  # see storeclient.delta
     description: Optional[str]
     developer_id: Optional[str]
     developer_name: Optional[str]
@@ -108,35 +129,59 @@ class SearchInfo:
             website=data.get('website'),
         )
 
-    def download(self, filename=None):
+    def download(self, filename=None) -> int:
+        """Download the snap, returning the number of bytes fetched."""
         if filename is None:
             filename = self.download_url.split('/')[-1]
 
-        r = requests.get(self.download_url, stream=True)
-        sha = hashlib.sha3_384()
-        BLOCKSIZE = 16 * 1024
-        with open(filename, 'wb') as f:
-            file_buffer = r.raw.read(BLOCKSIZE)
-            f.write(file_buffer)
-            while len(file_buffer) > 0:
-                file_buffer = r.raw.read(BLOCKSIZE)
-                f.write(file_buffer)
-                sha.update(file_buffer)
-        if sha.hexdigest() != self.download_sha3_384:
+        size, digest = download_file(self.download_url, filename)
+        if digest != self.download_sha3_384:
             raise ValueError("Hash failed")
+        return size
 
 
 class Store:
 
-    def __init__(self, client: Optional[Client] = None) -> None:
-        self.client = client or Client.get_default()
+    def __init__(self,
+                 client: Optional[Client] = None,
+                 *,
+                 pool: Optional[ClientPool] = None) -> None:
+        self._client = client
+        self.pool = pool
+
+    @property
+    def client(self) -> Client:
+        if self._client is not None:
+            return self._client
+        if self.pool is not None:
+            return self.pool.get()
+        return Client.get_default()
+
+    def _get_pool(self) -> ClientPool:
+        if self.pool is None:
+            if self._client is None:
+                self.pool = ClientPool.get_default()
+            else:
+                self.pool = ClientPool.for_client(self._client)
+        return self.pool
+
+    @contextmanager
+    def batch(self) -> Iterator['Store']:
+        """Borrow a client from the pool for a batch of requests.
+
+        The yielded store uses the leased client exclusively until the
+        with block exits, when the client is returned to the pool.
+        """
+        pool = self._get_pool()
+        with pool.lease() as lease:
+            yield Store(lease.client, pool=pool)
 
     def snap(self, name: str) -> Snap:
         """Get info from the snap and its released revisions."""
         r = self.client.snap_info(name)
         r.raise_for_status()
 
-        data: Dict[str, Any] = r.json()
+        data: Dict[str, Any] = self.client.decode(r)
         return Snap(
             _client=self.client,
             _data=data,
@@ -144,22 +189,77 @@ class Store:
             id=data['snap-id'],
         )
 
+    def media_for(self,
+                  snaps: Iterable[Union[Snap, str]],
+                  *,
+                  workers: int = 8) -> Dict[str, List[Dict[str, str]]]:
+        """Return the binary metadata of many snaps keyed by snap_id.
+
+        Snaps may be given as Snap objects or snap ids. Metadata missing
+        from the client's media cache is fetched concurrently with clients
+        leased from the store's pool, which share the authorization and
+        media caches and keep their connections open between calls, so
+        only one authorization handshake is made.
+        """
+        client = self.client
+        snap_ids = [snap.id if isinstance(snap, Snap) else snap
+                    for snap in snaps]
+        missing = [snap_id for snap_id in dict.fromkeys(snap_ids)
+                   if snap_id not in client.media_cache]
+        media: Dict[str, List[Dict[str, str]]] = {}
+        if missing:
+            from concurrent.futures import ThreadPoolExecutor
+
+            client.authorize()
+            pool = self._get_pool()
+
+            def fetch(snap_id: str) -> List[Dict[str, str]]:
+                with pool.lease() as lease:
+                    return lease.client.get_cached_binary_metadata(snap_id)
+
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                media.update(zip(missing, executor.map(fetch, missing)))
+        for snap_id in snap_ids:
+            if snap_id not in media:
+                media[snap_id] = client.get_cached_binary_metadata(snap_id)
+        return media
+
     def snaps(self) -> List[SearchInfo]:
         return self.search()
 
     def search(self,
                text: Optional[str]=None,
-               fields: Optional[List[str]]=None) -> List[SearchInfo]:
-        page = None
+               fields: Optional[List[str]]=None,
+               *,
+               delta_formats: Optional[List[str]] = None) -> List[SearchInfo]:
+        for page, infos in self.search_pages(
+                text=text, fields=fields, delta_formats=delta_formats):
+            yield from infos
+
+    def search_pages(self,
+                     text: Optional[str] = None,
+                     fields: Optional[List[str]] = None,
+                     *,
+                     start_page: Optional[int] = None,
+                     delta_formats: Optional[List[str]] = None,
+                     ) -> Iterator[Tuple[int, List[SearchInfo]]]:
+        """Iterate over search results one page at a time.
+
+        Yields tuples of the page number and the parsed rows of that page,
+        starting at start_page, so an interrupted crawl can be resumed.
+        """
+        page = start_page
         while True:
             r = self.client.search(
                 text=text,
                 fields=fields,
                 page=page,
-                page_size=100)
-            data = r.json()
-            for row in data['_embedded']['clickindex:package']:
-                yield SearchInfo.from_json(row)
+                page_size=100,
+                delta_formats=delta_formats)
+            data = self.client.decode(r)
+            infos = [SearchInfo.from_json(row)
+                     for row in data['_embedded']['clickindex:package']]
+            yield page or 1, infos
             next = data['_links'].get('next')
             if next is None:
                 break
@@ -0,0 +1,193 @@
+import asyncio
+import sys
+import time
+from dataclasses import dataclass
+from typing import (Any, AsyncIterator, Callable, Dict, Iterable, List,
+                    Optional, Tuple, Union)
+
+from storeclient.client import Client
+from storeclient.enums import RiskType
+
+# (track, risk, architecture)
+ChannelKey = Tuple[str, RiskType, str]
+ChannelState = Dict[ChannelKey, int]
+
+# Only revisions are needed to diff, the channel map is always included.
+WATCH_FIELDS = ['revision']
+
+
+@dataclass
+class ReleaseEvent:
+    """A revision was released to a channel."""
+    snap: str
+    track: str
+    risk: RiskType
+    architecture: str
+    revision: int
+    previous_revision: Optional[int]
+
+
+@dataclass
+class CloseEvent:
+    """A channel no longer has a revision released to it."""
+    snap: str
+    track: str
+    risk: RiskType
+    architecture: str
+    previous_revision: int
+
+
+Event = Union[ReleaseEvent, CloseEvent]
+
+
+def channel_state(channel_maps: List[Dict[str, Any]]) -> ChannelState:
+    """Map each channel of a snap_info channel map to its revision."""
+    state = {}
+    for channel_map in channel_maps:
+        channel = channel_map['channel']
+        key = (channel['track'],
+               RiskType[channel['risk']],
+               channel['architecture'])
+        state[key] = channel_map['revision']
+    return state
+
+
+def diff_channels(snap: str,
+                  old: ChannelState,
+                  new: ChannelState) -> List[Event]:
+    events: List[Event] = []
+    for key, revision in new.items():
+        previous = old.get(key)
+        if previous != revision:
+            events.append(ReleaseEvent(snap, *key, revision=revision,
+                                       previous_revision=previous))
+    for key, previous in old.items():
+        if key not in new:
+            events.append(CloseEvent(snap, *key, previous_revision=previous))
+    return events
+
+
+@dataclass
+class _WatchedSnap:
+    channels: Optional[ChannelState] = None
+    etag: Optional[str] = None
+    interval: float = 0
+    next_poll: float = 0
+
+
+class ReleaseWatcher:
+    """Poll the channel maps of snaps and report what changed.
+
+    Each snap is polled on its own schedule. The interval starts at
+    min_interval, grows by backoff every time nothing changed up to
+    max_interval, and drops back to min_interval after a change. Requests
+    only ask for revisions and send the ETag of the previous response, so
+    an unchanged snap costs a 304 and no parsing.
+
+    A failed poll of one snap, such as a 404 for a removed snap or a
+    connection error, is passed to error_callback (or printed to stderr)
+    and backs off that snap's interval without stopping the others.
+    """
+
+    def __init__(self,
+                 snaps: Iterable[str] = (),
+                 *,
+                 client: Optional[Client] = None,
+                 callback: Optional[Callable[[Event], None]] = None,
+                 error_callback: Optional[
+                     Callable[[str, Exception], None]] = None,
+                 min_interval: float = 60,
+                 max_interval: float = 3600,
+                 backoff: float = 2.0,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.client = client or Client.get_default()
+        self.callback = callback
+        self.error_callback = error_callback
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.clock = clock
+        self._snaps: Dict[str, _WatchedSnap] = {}
+        for name in snaps:
+            self.add(name)
+
+    def add(self, name: str) -> None:
+        self._snaps.setdefault(name, _WatchedSnap(interval=self.min_interval))
+
+    def remove(self, name: str) -> None:
+        self._snaps.pop(name, None)
+
+    def channels(self, name: str) -> Optional[ChannelState]:
+        """Return the last known channel state of a snap."""
+        return self._snaps[name].channels
+
+    def poll(self, name: str) -> List[Event]:
+        """Poll one snap now, returning the changes since the last poll.
+
+        The first poll of a snap only records its state.
+        """
+        watched = self._snaps[name]
+        r = self.client.snap_info(name, fields=WATCH_FIELDS,
+                                  etag=watched.etag)
+        events: List[Event] = []
+        if r.status_code != 304:
+            r.raise_for_status()
+            channels = channel_state(self.client.decode(r)['channel-map'])
+            if watched.channels is not None:
+                events = diff_channels(name, watched.channels, channels)
+            watched.channels = channels
+            watched.etag = r.headers.get('ETag')
+
+        if events:
+            watched.interval = self.min_interval
+        else:
+            watched.interval = min(watched.interval * self.backoff,
+                                   self.max_interval)
+        watched.next_poll = self.clock() + watched.interval
+        if self.callback is not None:
+            for event in events:
+                self.callback(event)
+        return events
+
+    def next_poll(self) -> float:
+        """Return the clock time at which the next snap is due."""
+        return min((watched.next_poll for watched in self._snaps.values()),
+                   default=self.clock() + self.min_interval)
+
+    def _poll_failed(self, name: str, error: Exception) -> None:
+        watched = self._snaps[name]
+        watched.interval = min(
+            max(watched.interval, self.min_interval) * self.backoff,
+            self.max_interval)
+        watched.next_poll = self.clock() + watched.interval
+        if self.error_callback is not None:
+            self.error_callback(name, error)
+        else:
+            sys.stderr.write(f'ERROR: polling {name} failed: {error}\n')
+
+    def poll_due(self) -> List[Event]:
+        """Poll every snap whose interval has elapsed."""
+        now = self.clock()
+        events: List[Event] = []
+        for name, watched in list(self._snaps.items()):
+            if watched.next_poll > now:
+                continue
+            try:
+                events.extend(self.poll(name))
+            except Exception as e:
+                self._poll_failed(name, e)
+        return events
+
+    def run(self, *, sleep: Callable[[float], None] = time.sleep) -> None:
+        """Poll forever, reporting events through the callback."""
+        while True:
+            self.poll_due()
+            sleep(max(0.0, self.next_poll() - self.clock()))
+
+    async def __aiter__(self) -> AsyncIterator[Event]:
+        loop = asyncio.get_running_loop()
+        while True:
+            events = await loop.run_in_executor(None, self.poll_due)
+            for event in events:
+                yield event
+            await asyncio.sleep(max(0.0, self.next_poll() - self.clock()))
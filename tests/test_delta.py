@@ -0,0 +1,134 @@
+import functools
+import hashlib
+import http.server
+import os
+import threading
+
+import pytest
+
+from storeclient import delta
+from storeclient.store import SearchInfo
+
+OLD = os.urandom(64 * 1024)
+NEW = OLD + b'new revision' * 100
+
+
+def append_applier(source, delta_filename, target):
+    """Toy delta format: the delta is appended to the source."""
+    with open(target, 'wb') as f:
+        for filename in (source, delta_filename):
+            with open(filename, 'rb') as src:
+                f.write(src.read())
+
+
+def broken_applier(source, delta_filename, target):
+    raise RuntimeError('applier failed')
+
+
+APPLIERS = {'append': append_applier}
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(tmp_path):
+    root = tmp_path / 'srv'
+    root.mkdir()
+    (root / 'full.snap').write_bytes(NEW)
+    (root / 'good.delta').write_bytes(NEW[len(OLD):])
+    (root / 'corrupt.delta').write_bytes(b'garbage')
+    handler = functools.partial(QuietHandler, directory=str(root))
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_port}/'
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    cache = tmp_path / 'cache'
+    cache.mkdir()
+    (cache / 'foo_1.snap').write_bytes(OLD)
+    return str(cache)
+
+
+def make_info(base_url, delta_name, delta_format='append'):
+    values = {name: None for name in SearchInfo.__dataclass_fields__}
+    values.update(
+        package_name='foo',
+        revision=2,
+        binary_filesize=len(NEW),
+        download_url=base_url + 'full.snap',
+        download_sha3_384=hashlib.sha3_384(NEW).hexdigest(),
+        deltas=[{
+            'from_revision': 1,
+            'to_revision': 2,
+            'format': delta_format,
+            'download_url': base_url + delta_name,
+        }],
+    )
+    return SearchInfo(**values)
+
+
+def read(filename):
+    with open(filename, 'rb') as f:
+        return f.read()
+
+
+def test_update_applies_delta(server, cache_dir):
+    result = delta.update(make_info(server, 'good.delta'), cache_dir,
+                          appliers=APPLIERS)
+    assert result.used_delta
+    assert result.bytes_downloaded == len(NEW) - len(OLD)
+    assert result.bytes_saved == len(OLD)
+    assert result.fallback_reason is None
+    assert read(result.filename) == NEW
+    assert os.listdir(cache_dir) == ['foo_2.snap']
+
+
+def test_update_falls_back_on_hash_mismatch(server, cache_dir):
+    result = delta.update(make_info(server, 'corrupt.delta'), cache_dir,
+                          appliers=APPLIERS)
+    assert not result.used_delta
+    assert result.bytes_downloaded == len(NEW)
+    assert result.bytes_saved == 0
+    assert result.fallback_reason == 'ValueError: Hash failed'
+    assert read(result.filename) == NEW
+
+
+def test_update_falls_back_when_applier_raises(server, cache_dir):
+    result = delta.update(make_info(server, 'good.delta'), cache_dir,
+                          appliers={'append': broken_applier})
+    assert not result.used_delta
+    assert result.fallback_reason == 'RuntimeError: applier failed'
+    assert read(result.filename) == NEW
+
+
+def test_update_falls_back_without_supported_delta(server, cache_dir):
+    result = delta.update(make_info(server, 'good.delta', 'xdelta3'),
+                          cache_dir, appliers=APPLIERS)
+    assert not result.used_delta
+    assert result.fallback_reason is None
+    assert read(result.filename) == NEW
+
+
+def test_update_keeps_current_revision(server, cache_dir):
+    info = make_info(server, 'good.delta')
+    delta.update(info, cache_dir, appliers=APPLIERS)
+    result = delta.update(info, cache_dir, appliers=APPLIERS)
+    assert result.bytes_downloaded == 0
+
+
+def test_update_keeps_newer_cached_revision(server, cache_dir):
+    os.rename(os.path.join(cache_dir, 'foo_1.snap'),
+              os.path.join(cache_dir, 'foo_3.snap'))
+    result = delta.update(make_info(server, 'good.delta'), cache_dir,
+                          appliers=APPLIERS)
+    assert not result.used_delta
+    assert read(result.filename) == NEW
+    assert sorted(os.listdir(cache_dir)) == ['foo_2.snap', 'foo_3.snap']
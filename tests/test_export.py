@@ -0,0 +1,166 @@
+import csv
+import functools
+import http.server
+import io
+import json
+import os
+import threading
+import time
+
+import pytest
+
+from storeclient.export import (Checkpoint, CSVWriter, ColumnarWriter,
+                                JSONLinesWriter, MediaDownloader, MediaRef,
+                                export_media)
+from storeclient.store import SearchInfo
+
+PAGES = 4
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server(tmp_path):
+    root = tmp_path / 'srv'
+    root.mkdir()
+    for page in range(1, PAGES + 1):
+        (root / f'icon-{page}.png').write_bytes(b'icon %d' % page)
+        (root / f'shot-{page}.png').write_bytes(b'shot %d' % page)
+    (root / 'shared.png').write_bytes(b'shared')
+    handler = functools.partial(QuietHandler, directory=str(root))
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f'http://127.0.0.1:{httpd.server_port}/'
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def make_info(base_url, page):
+    values = {name: None for name in SearchInfo.__dataclass_fields__}
+    values.update(
+        package_name=f'snap-{page}',
+        icon_url=base_url + f'icon-{page}.png',
+        screenshot_urls=[base_url + f'shot-{page}.png',
+                         base_url + 'shared.png'],
+    )
+    return SearchInfo(**values)
+
+
+class FakeStore:
+    def __init__(self, base_url, fail_after=None):
+        self.base_url = base_url
+        self.fail_after = fail_after
+        self.start_pages = []
+
+    def search_pages(self, text=None, start_page=None):
+        self.start_pages.append(start_page)
+        for page in range(start_page or 1, PAGES + 1):
+            if page == self.fail_after:
+                raise ConnectionError('search failed')
+            yield page, [make_info(self.base_url, page)]
+
+
+class SlowDownloader(MediaDownloader):
+    def _download(self, url):
+        time.sleep(0.1)
+        return super()._download(url)
+
+
+def read_jsonl(filename):
+    with open(filename, 'rb') as f:
+        return [json.loads(line) for line in f]
+
+
+def test_writers():
+    refs = [MediaRef(1, 'foo', 'icon', 'http://x/a.png'),
+            MediaRef(1, 'foo', 'screenshot', 'http://x/b,c.png')]
+
+    fp = io.BytesIO()
+    JSONLinesWriter(fp).write(refs)
+    assert [json.loads(line) for line in fp.getvalue().splitlines()] == [
+        {'page': 1, 'snap_name': 'foo', 'media_type': 'icon',
+         'url': 'http://x/a.png'},
+        {'page': 1, 'snap_name': 'foo', 'media_type': 'screenshot',
+         'url': 'http://x/b,c.png'},
+    ]
+
+    fp = io.BytesIO()
+    CSVWriter(fp).write(refs)
+    CSVWriter(fp).write(refs[:1])
+    rows = list(csv.reader(io.StringIO(fp.getvalue().decode())))
+    assert rows == [['page', 'snap_name', 'media_type', 'url'],
+                    ['1', 'foo', 'icon', 'http://x/a.png'],
+                    ['1', 'foo', 'screenshot', 'http://x/b,c.png'],
+                    ['1', 'foo', 'icon', 'http://x/a.png']]
+
+    fp = io.BytesIO()
+    writer = ColumnarWriter(fp)
+    writer.write(refs)
+    writer.write([])
+    assert [json.loads(line) for line in fp.getvalue().splitlines()] == [{
+        'page': [1, 1],
+        'snap_name': ['foo', 'foo'],
+        'media_type': ['icon', 'screenshot'],
+        'url': ['http://x/a.png', 'http://x/b,c.png'],
+    }]
+
+
+def test_export_unknown_format(tmp_path):
+    with pytest.raises(ValueError):
+        export_media(FakeStore(''), str(tmp_path / 'out'), format='xml')
+
+
+def test_downloader_fetches_each_url_once(server, tmp_path):
+    with MediaDownloader(str(tmp_path / 'media')) as downloader:
+        first = downloader.submit(server + 'shared.png')
+        assert downloader.submit(server + 'shared.png') is None
+        downloader.submit(server + 'missing.png')
+    assert first.result() == downloader.local_path(server + 'shared.png')
+    with open(first.result(), 'rb') as f:
+        assert f.read() == b'shared'
+    assert list(downloader.failures) == [server + 'missing.png']
+    assert os.listdir(str(tmp_path / 'media')) == [
+        os.path.basename(first.result())]
+
+
+def test_local_path_is_unique_per_url(tmp_path):
+    downloader = MediaDownloader(str(tmp_path))
+    a = downloader.local_path('http://x/foo/icon.png')
+    b = downloader.local_path('http://x/bar/icon.png?size=2')
+    assert a != b
+    assert a.endswith('.png') and b.endswith('.png')
+    downloader.close()
+
+
+def test_export_resumes_rows_and_downloads(server, tmp_path):
+    output = str(tmp_path / 'media.jsonl')
+    media = str(tmp_path / 'media')
+
+    store = FakeStore(server, fail_after=3)
+    downloader = SlowDownloader(media)
+    with pytest.raises(ConnectionError):
+        export_media(store, output, downloader=downloader)
+    state = Checkpoint.load(output + '.checkpoint')
+    assert (state.page, state.rows, state.complete) == (2, 6, False)
+    # Media of checkpointed pages are on disk without waiting for close().
+    assert len(os.listdir(media)) == 5
+    downloader.close()
+
+    store = FakeStore(server)
+    with MediaDownloader(media) as downloader:
+        state = export_media(store, output, downloader=downloader)
+    assert store.start_pages == [3]
+    assert (state.page, state.rows, state.complete) == (PAGES, 12, True)
+    assert [row['page'] for row in read_jsonl(output)] == [
+        page for page in range(1, PAGES + 1) for _ in range(3)]
+    assert len(os.listdir(media)) == 2 * PAGES + 1
+    assert not downloader.failures
+
+    # A complete export is not repeated.
+    store = FakeStore(server)
+    assert export_media(store, output).complete
+    assert store.start_pages == []
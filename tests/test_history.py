@@ -0,0 +1,175 @@
+import datetime
+import hashlib
+import os
+
+import numpy as np
+import pytest
+
+from storeclient.channel import Channel
+from storeclient.enums import RiskType
+from storeclient.history import COLUMNS, ChannelHistory
+
+T0 = datetime.datetime(2020, 1, 1, tzinfo=datetime.timezone.utc)
+DAY = datetime.timedelta(days=1)
+
+
+def channel(revision, architecture='amd64', risk=RiskType.stable,
+            track='latest', released_at=T0, size=None, sha3_384=None):
+    if sha3_384 is None:
+        sha3_384 = hashlib.sha3_384(b'%d' % revision).hexdigest()
+    return Channel(
+        name=f'{track}/{risk.value}',
+        revision=revision,
+        architecture=architecture,
+        risk=risk,
+        created_at=released_at,
+        released_at=released_at,
+        track=track,
+        sha3_384=sha3_384,
+        size=size or revision * 100,
+        url='',
+        version='1.0',
+    )
+
+
+def rows(history, **kwargs):
+    return [(row['snap'], row['architecture'], row['revision'])
+            for row in history.rows(history.select(**kwargs))]
+
+
+def test_append_and_reopen(tmp_path):
+    history = ChannelHistory(str(tmp_path))
+    assert len(history) == 0
+    assert history.select().tolist() == []
+    assert history.append('foo', []) == 0
+    assert history.append('foo', [channel(1), channel(2, 'arm64')],
+                          snapshot_at=T0) == 2
+
+    reopened = ChannelHistory(str(tmp_path))
+    assert len(reopened) == 2
+    row, = reopened.rows(reopened.select(architecture='arm64'))
+    assert row == {
+        'snapshot_at': T0,
+        'snap': 'foo',
+        'track': 'latest',
+        'architecture': 'arm64',
+        'risk': RiskType.stable,
+        'revision': 2,
+        'size': 200,
+        'released_at': T0,
+        'sha3_384': hashlib.sha3_384(b'2').hexdigest(),
+    }
+
+
+def test_instances_appending_in_turn(tmp_path):
+    a = ChannelHistory(str(tmp_path))
+    b = ChannelHistory(str(tmp_path))
+    b.append('x', [channel(1, 'amd64')])
+    a.append('y', [channel(2, 'arm64')])
+    b.append('z', [channel(3, 'armhf')])
+    expected = [('x', 'amd64', 1), ('y', 'arm64', 2), ('z', 'armhf', 3)]
+    for history in (a, b, ChannelHistory(str(tmp_path))):
+        assert rows(history) == expected
+    assert rows(ChannelHistory(str(tmp_path)),
+                risk='stable', architecture='amd64', since=T0) == [
+        ('x', 'amd64', 1)]
+
+
+def test_reader_sees_external_appends(tmp_path):
+    writer = ChannelHistory(str(tmp_path))
+    reader = ChannelHistory(str(tmp_path))
+    writer.append('foo', [channel(1)])
+    assert rows(reader, snap='foo') == [('foo', 'amd64', 1)]
+    writer.append('bar', [channel(2)])
+    assert rows(reader, snap='bar') == [('bar', 'amd64', 2)]
+    assert len(reader.column('revision')) == 2
+
+
+@pytest.fixture
+def history(tmp_path):
+    history = ChannelHistory(str(tmp_path))
+    for day in range(3):
+        snapshot_at = T0 + day * DAY
+        # foo/stable is released on day 0 and again on day 2.
+        stable = 1 if day < 2 else 3
+        history.append('foo', [
+            channel(stable, released_at=T0 + (day // 2) * 2 * DAY),
+            channel(2, risk=RiskType.edge),
+            channel(stable, 'arm64', released_at=T0),
+        ], snapshot_at=snapshot_at)
+        history.append('bar', [channel(10, size=5000)],
+                       snapshot_at=snapshot_at)
+    return history
+
+
+def test_select(history):
+    assert len(history) == 12
+    assert len(history.select(snap='foo')) == 9
+    assert len(history.select(snap='foo', risk=RiskType.edge)) == 3
+    assert len(history.select(snap='foo', risk='stable',
+                              architecture='arm64')) == 3
+    assert history.select(snap='missing').tolist() == []
+    assert rows(history, snap='foo', since=T0 + DAY) == [
+        ('foo', 'amd64', 3)]
+    assert len(history.select(snap='foo', since=T0 + DAY,
+                              time_column='snapshot_at')) == 6
+    assert len(history.select(until=T0 + DAY,
+                              time_column='snapshot_at')) == 4
+
+
+def test_releases(history):
+    releases = history.releases(history.select(snap='foo'))
+    assert [(row['revision'], row['risk'], row['architecture'],
+             row['snapshot_at']) for row in history.rows(releases)] == [
+        (1, RiskType.stable, 'amd64', T0),
+        (2, RiskType.edge, 'amd64', T0),
+        (1, RiskType.stable, 'arm64', T0),
+        (3, RiskType.stable, 'amd64', T0 + 2 * DAY),
+        (3, RiskType.stable, 'arm64', T0 + 2 * DAY),
+    ]
+    assert len(history.releases()) == 6
+
+
+def test_count_by_and_size_stats(history):
+    releases = history.releases()
+    assert history.count_by('snap', releases) == {'foo': 5, 'bar': 1}
+    assert history.count_by('architecture', releases) == {
+        'amd64': 4, 'arm64': 2}
+    assert history.size_stats(releases) == {
+        'count': 6, 'total': 100 + 200 + 100 + 300 + 300 + 5000,
+        'mean': 6000 / 6, 'max': 5000}
+    assert history.size_stats(history.select(snap='missing')) == {
+        'count': 0, 'total': 0, 'mean': 0.0, 'max': 0}
+
+
+def test_invalid_digest_writes_nothing(tmp_path):
+    history = ChannelHistory(str(tmp_path))
+    history.append('foo', [channel(1)])
+    files = {name: os.path.getsize(os.path.join(str(tmp_path), name))
+             for name in os.listdir(str(tmp_path))}
+    for digest in ['', 'abcd', hashlib.sha256(b'').hexdigest(), 'zz' * 48]:
+        with pytest.raises(ValueError):
+            history.append('bar', [channel(2), channel(3, sha3_384=digest)])
+    assert files == {
+        name: os.path.getsize(os.path.join(str(tmp_path), name))
+        for name in os.listdir(str(tmp_path))}
+    assert 'bar' not in ChannelHistory(str(tmp_path))._dictionaries['snap']
+
+
+def test_uneven_columns_are_truncated(tmp_path):
+    history = ChannelHistory(str(tmp_path))
+    history.append('foo', [channel(1), channel(2)])
+    # Simulate a crash after some columns of the next append were written.
+    for name in list(COLUMNS)[:3]:
+        with open(os.path.join(str(tmp_path), name), 'ab') as f:
+            np.zeros(1, dtype=COLUMNS[name]).tofile(f)
+    history = ChannelHistory(str(tmp_path))
+    assert len(history) == 2
+    assert rows(history) == [('foo', 'amd64', 1), ('foo', 'amd64', 2)]
+
+    history.append('bar', [channel(3)])
+    sizes = {os.path.getsize(os.path.join(str(tmp_path), name)) //
+             np.dtype(dtype).itemsize for name, dtype in COLUMNS.items()}
+    assert sizes == {3}
+    assert rows(ChannelHistory(str(tmp_path))) == [
+        ('foo', 'amd64', 1), ('foo', 'amd64', 2), ('bar', 'amd64', 3)]
@@ -0,0 +1,58 @@
+"""Import-time budget for the storeclient command line and store module.
+
+python -X importtime is run in a subprocess so modules already imported
+by pytest do not hide the cost. Budgets are in microseconds and can be
+scaled for slow machines with STORECLIENT_IMPORT_BUDGET_SCALE.
+"""
+import os
+import subprocess
+import sys
+from typing import Dict
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BUDGETS = {
+    'storeclient.cli': 50000,
+    'storeclient.store': 150000,
+}
+DEFERRED_MODULES = [
+    'concurrent.futures',
+    'hashlib',
+    'mimetypes',
+    'pprint',
+    'pymacaroons',
+    'requests',
+]
+
+
+def import_times(module: str) -> Dict[str, int]:
+    """Return the cumulative import time in microseconds of each module."""
+    proc = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=ROOT, stderr=subprocess.PIPE, universal_newlines=True,
+        check=True)
+    times = {}
+    for line in proc.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        self_us, cumulative, name = line[len('import time:'):].split('|')
+        if not cumulative.strip().isdigit():
+            continue
+        times[name.strip()] = int(cumulative)
+    return times
+
+
+@pytest.mark.parametrize('module', sorted(BUDGETS))
+def test_deferred_modules_not_imported(module):
+    times = import_times(module)
+    assert [name for name in DEFERRED_MODULES if name in times] == []
+
+
+@pytest.mark.parametrize('module', sorted(BUDGETS))
+def test_import_time_budget(module):
+    scale = float(os.environ.get('STORECLIENT_IMPORT_BUDGET_SCALE', '1'))
+    budget = BUDGETS[module] * scale
+    # Take the best of a few runs to keep disk cache misses out of it.
+    total = min(import_times(module)[module] for _ in range(3))
+    assert total <= budget, f'{module} took {total}us, budget {budget}us'
@@ -0,0 +1,112 @@
+import random
+
+import pytest
+from PIL import Image
+
+import mediahash
+from mediahash import HashIndex, find_duplicates, hamming, process_file
+from parsemedia import MediaRow
+
+
+def brute_force(hashes, value, max_distance):
+    return [(position, hamming(value, other))
+            for position, other in enumerate(hashes)
+            if hamming(value, other) <= max_distance]
+
+
+@pytest.mark.parametrize('max_distance', [0, 1, 4, 10])
+def test_hash_index_matches_brute_force(max_distance):
+    rng = random.Random(max_distance)
+    index = HashIndex(max_distance)
+    hashes = []
+    for _ in range(500):
+        if hashes and rng.random() < 0.5:
+            # A near duplicate of a previous hash.
+            value = rng.choice(hashes)
+            for _ in range(rng.randint(0, max_distance + 2)):
+                value ^= 1 << rng.randrange(64)
+        else:
+            value = rng.getrandbits(64)
+        assert index.query(value) == brute_force(hashes, value, max_distance)
+        assert index.add(value) == len(hashes)
+        hashes.append(value)
+    assert len(index) == len(hashes)
+
+
+def gradient(mode, size=(1280, 720)):
+    img = Image.linear_gradient('L').resize(size)
+    if mode == 'P':
+        return img.convert('RGB').convert('P', palette=Image.ADAPTIVE)
+    return img.convert(mode)
+
+
+@pytest.mark.parametrize('mode, extension', [
+    ('RGB', 'png'),
+    ('RGB', 'jpg'),
+    ('P', 'gif'),
+    ('P', 'png'),
+    ('1', 'png'),
+    ('CMYK', 'jpg'),
+    ('LA', 'png'),
+])
+def test_process_file_modes(tmp_path, mode, extension):
+    local = str(tmp_path / f'image.{extension}')
+    gradient(mode).save(local)
+    cache_dir = tmp_path / 'cache'
+    cache_dir.mkdir()
+    digest, thumbnail, phash = process_file(local, str(cache_dir))
+    assert digest == mediahash.content_hash(local)
+    assert max(Image.open(thumbnail).size) <= max(mediahash.THUMBNAIL_SIZE)
+    assert 0 <= phash < 1 << mediahash.HASH_BITS
+
+
+def test_process_file_uses_cache(tmp_path, monkeypatch):
+    local = str(tmp_path / 'image.png')
+    gradient('RGB').save(local)
+    first = process_file(local, str(tmp_path))
+
+    def fail(*args):
+        raise AssertionError('image decoded again')
+
+    monkeypatch.setattr(mediahash, 'open_reduced', fail)
+    assert process_file(local, str(tmp_path)) == first
+
+
+def test_similar_images_have_close_hashes(tmp_path):
+    gradient('RGB').save(str(tmp_path / 'a.png'))
+    gradient('RGB', (1920, 1080)).save(str(tmp_path / 'b.jpg'), quality=70)
+    Image.linear_gradient('L').rotate(90).resize((1280, 720)).save(
+        str(tmp_path / 'c.png'))
+    _, _, a = process_file(str(tmp_path / 'a.png'), str(tmp_path))
+    _, _, b = process_file(str(tmp_path / 'b.jpg'), str(tmp_path))
+    _, _, c = process_file(str(tmp_path / 'c.png'), str(tmp_path))
+    assert hamming(a, b) <= 4
+    assert hamming(a, c) > 4
+
+
+def row(id, snap_name='foo', media_type='screenshot'):
+    return MediaRow(snap_name, id, media_type, '', '', '', f'{id}.png')
+
+
+def test_process_media_skips_failures(tmp_path, monkeypatch):
+    media_dir = tmp_path / 'media'
+    media_dir.mkdir()
+    gradient('RGB').save(str(media_dir / 'good.png'))
+    (media_dir / 'broken.png').write_bytes(b'not an image')
+
+    def fetch_media(media_row, directory):
+        if media_row.id == 'mismatch':
+            raise ValueError('Hash does not match')
+        return str(media_dir / f'{media_row.id}.png')
+
+    monkeypatch.setattr(mediahash, 'fetch_media', fetch_media)
+    batches = [[row('good'), row('mismatch')],
+               [row('broken'), row('good', 'bar')]]
+    items = list(mediahash.process_media(
+        iter(batches), str(media_dir), str(tmp_path / 'cache'),
+        workers=2, download_workers=2, max_pending=1))
+    assert [(item.snap_name, item.local) for item in items] == [
+        ('foo', str(media_dir / 'good.png')),
+        ('bar', str(media_dir / 'good.png'))]
+    assert [[item.snap_name for item in group]
+            for group in find_duplicates(items)] == [['foo', 'bar']]
@@ -0,0 +1,146 @@
+import functools
+import hashlib
+import http.server
+import io
+import os
+import random
+import threading
+
+import pytest
+from PIL import Image
+
+import parsemedia
+from parsemedia import (MediaInfo, MediaPipeline, MediaRow, MediaTable,
+                        calculate_aspect, count_media, count_media_columnar,
+                        fetch_media)
+
+MEDIA_TYPES = ['icon', 'icon_256', 'screenshot', 'banner', 'video']
+FORMATS = ['PNG', 'JPEG', 'GIF', 'WEBP']
+SIZES = [16, 256, 320, 479, 480, 1080, 1920, 2160, 2161, 3840, 3841, 5000]
+
+
+def random_info(rng, snaps):
+    width = rng.choice(SIZES)
+    height = rng.choice(SIZES)
+    animated = rng.random() < 0.3
+    fps = rng.choice([0.5, 1.0, 12.5, 30.0, 60.0]) if animated else 0
+    framecount = rng.randint(1, 100) if animated else 0
+    return MediaInfo(
+        snap_name=rng.choice(snaps),
+        media_type=rng.choice(MEDIA_TYPES),
+        filename='file',
+        format=rng.choice(FORMATS),
+        width=width,
+        height=height,
+        aspect_ratio=calculate_aspect(width, height),
+        size=rng.choice([1000, 256 * 1024, 256 * 1024 + 1,
+                         2 * 1024 * 1024, 2 * 1024 * 1024 + 1]),
+        framecount=framecount,
+        fps=fps,
+        length=framecount * fps,
+    )
+
+
+def assert_same_counters(expected, actual):
+    assert list(actual) == list(expected)
+    for name, counter in expected.items():
+        # Key order matters too, it decides most_common() ties.
+        assert list(actual[name].items()) == list(counter.items()), name
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_count_media_columnar_matches_count_media(seed):
+    rng = random.Random(seed)
+    snaps = [f'snap-{i}' for i in range(rng.randint(1, 30))]
+    rows = [random_info(rng, snaps) for _ in range(rng.randint(1, 500))]
+    assert_same_counters(count_media(rows),
+                         count_media_columnar(MediaTable.from_infos(rows)))
+
+
+def test_count_media_columnar_empty():
+    assert_same_counters(count_media([]),
+                         count_media_columnar(MediaTable.from_infos([])))
+
+
+def test_count_media_columnar_many_screenshots():
+    rows = [MediaInfo('foo', 'screenshot', 'f', 'PNG', 1920, 1080, '16:9',
+                      1000, 0, 0, 0)] * 12
+    rows.append(rows[0]._replace(snap_name='bar', media_type='icon'))
+    counters = count_media_columnar(MediaTable.from_infos(rows))
+    assert counters['screenshots'] == {'10+': 1, '0': 1}
+    assert_same_counters(count_media(rows), counters)
+
+
+def png(width, height):
+    buf = io.BytesIO()
+    Image.new('RGB', (width, height)).save(buf, 'PNG')
+    return buf.getvalue()
+
+
+SHOT = png(1920, 1080)
+ICON = png(256, 256)
+
+
+class QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def media_root(tmp_path, monkeypatch):
+    root = tmp_path / 'srv'
+    root.mkdir()
+    (root / 'shot.png').write_bytes(SHOT)
+    (root / 'icon.png').write_bytes(ICON)
+    handler = functools.partial(QuietHandler, directory=str(root))
+    httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(parsemedia, 'MEDIA_ROOT',
+                        f'http://127.0.0.1:{httpd.server_port}/')
+    yield root
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def media_row(id, path, media_type='screenshot', media_hash=None):
+    if media_hash is None:
+        media_hash = hashlib.sha256(SHOT if path == 'shot.png' else ICON
+                                    ).hexdigest()
+    return MediaRow('foo', id, media_type, '', path, media_hash, path)
+
+
+def test_fetch_media_verifies_and_caches(media_root, tmp_path):
+    local = fetch_media(media_row('1', 'shot.png'), str(tmp_path))
+    with open(local, 'rb') as f:
+        assert f.read() == SHOT
+    (media_root / 'shot.png').unlink()
+    assert fetch_media(media_row('1', 'shot.png'), str(tmp_path)) == local
+
+
+def test_fetch_media_gives_up_on_hash_mismatch(media_root, tmp_path):
+    media_dir = tmp_path / 'media'
+    media_dir.mkdir()
+    row = media_row('1', 'shot.png', media_hash='0' * 64)
+    with pytest.raises(ValueError):
+        fetch_media(row, str(media_dir), retries=2)
+    # Nothing is left behind to be taken for a cached file.
+    assert os.listdir(str(media_dir)) == []
+
+
+def test_pipeline_counts_media(media_root, tmp_path):
+    batches = [[media_row('1', 'shot.png'), media_row('2', 'shot.png')],
+               [media_row('3', 'icon.png', 'icon')]]
+    counters = MediaPipeline(str(tmp_path), download_workers=2).run(
+        iter(batches))
+    assert counters['media_types'] == {'screenshot': 2, 'icon': 1}
+    assert counters['aspect_ratios'] == {'16:9': 2, 'Total': 2}
+    assert counters['totals'] == {'total': 3}
+
+
+def test_pipeline_raises_on_hash_mismatch(media_root, tmp_path):
+    batches = [[media_row(str(i), 'shot.png')] for i in range(20)]
+    batches[3] = [media_row('3', 'shot.png', media_hash='0' * 64)]
+    pipeline = MediaPipeline(str(tmp_path), queue_size=1, download_workers=2)
+    with pytest.raises(ValueError):
+        pipeline.run(iter(batches))
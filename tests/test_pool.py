@@ -0,0 +1,85 @@
+import threading
+
+from storeclient.client import ALL_PERMISSIONS
+from storeclient.pool import ClientPool
+
+
+def in_thread(target):
+    result = []
+    thread = threading.Thread(target=lambda: result.append(target()))
+    thread.start()
+    thread.join()
+    return result[0]
+
+
+def test_get_returns_one_client_per_thread():
+    pool = ClientPool()
+    client = pool.get()
+    assert pool.get() is client
+    other = in_thread(pool.get)
+    assert other is not client
+    assert other.auth_cache is client.auth_cache
+    assert other.media_cache is client.media_cache
+    assert pool.stats.created == 2
+
+
+def test_lease_reuses_idle_clients():
+    pool = ClientPool()
+    with pool.lease() as first:
+        with pool.lease() as second:
+            assert second.client is not first.client
+    with pool.lease() as third:
+        assert third.client in (first.client, second.client)
+    assert pool.stats.created == 2
+    assert pool.stats.leases == 3
+
+
+def test_lease_keeps_at_most_max_idle():
+    pool = ClientPool(max_idle=1)
+    with pool.lease(), pool.lease():
+        pass
+    assert len(pool._idle) == 1
+
+
+def test_lease_resets_channels_and_permissions():
+    pool = ClientPool(permissions=['package_access'])
+    with pool.lease() as lease:
+        assert lease.client.permissions == ['package_access']
+        lease.client.channels.append('edge')
+        lease.client.permissions = ['package_manage']
+    with pool.lease() as lease:
+        assert lease.client.channels == []
+        assert lease.client.permissions == ['package_access']
+    assert pool.permissions == ['package_access']
+    assert ClientPool().get().permissions == ALL_PERMISSIONS
+
+
+def test_lease_stats():
+    pool = ClientPool()
+    with pool.lease() as lease:
+        lease.client.request_count += 3
+    assert lease.stats.requests == 3
+    assert lease.stats.seconds >= 0
+    with pool.lease() as lease:
+        lease.client.request_count += 2
+    assert lease.stats.requests == 2
+    assert pool.stats.requests == 5
+    assert pool.stats.leases == 2
+    assert pool.stats.seconds >= lease.stats.seconds
+
+
+def test_get_default_is_shared_between_threads():
+    barrier = threading.Barrier(8)
+
+    def get_default():
+        barrier.wait()
+        return ClientPool.get_default()
+
+    pools = []
+    threads = [threading.Thread(target=lambda: pools.append(get_default()))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(pool is ClientPool.get_default() for pool in pools)
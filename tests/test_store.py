@@ -0,0 +1,139 @@
+import io
+import json
+import threading
+
+import pytest
+
+from storeclient.client import Client
+from storeclient.enums import MediaType
+from storeclient.pool import ClientPool
+from storeclient.store import Store
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, data):
+        self.content = json.dumps(data).encode()
+
+    def raise_for_status(self):
+        pass
+
+
+class FakeSCA:
+    """Answer binary metadata requests in place of Client._request."""
+
+    def __init__(self):
+        self.metadata = {}
+        self.requests = []
+        self.clients = set()
+        self.handshakes = 0
+        self.on_get = None
+        self._lock = threading.Lock()
+
+    def request(self, client, base_url, method, url, **kwargs):
+        snap_id = url.split('/')[-2]
+        with self._lock:
+            self.requests.append((method, snap_id))
+            self.clients.add(client)
+        if method == 'POST':
+            self.metadata[snap_id] = json.loads(kwargs['data']['info'])
+            return FakeResponse({})
+        if self.on_get is not None:
+            self.on_get(client, snap_id)
+        return FakeResponse(self.metadata.get(snap_id, []))
+
+    def authorize(self, client):
+        with self._lock:
+            self.handshakes += 1
+        return 'Macaroon'
+
+    def gets(self):
+        return sorted(snap_id for method, snap_id in self.requests
+                      if method == 'GET')
+
+
+@pytest.fixture
+def sca(monkeypatch):
+    sca = FakeSCA()
+    monkeypatch.setattr(Client, '_request',
+                        lambda self, *args, **kwargs:
+                        sca.request(self, *args, **kwargs))
+    monkeypatch.setattr(Client, '_authorize', lambda self: sca.authorize(self))
+    return sca
+
+
+@pytest.fixture
+def store():
+    return Store(pool=ClientPool())
+
+
+SNAP_IDS = [f'id{i}' for i in range(20)]
+
+
+def test_media_for_authorizes_once(sca, store):
+    sca.metadata['id3'] = [{'type': 'icon', 'hash': 'abc'}]
+    media = store.media_for(SNAP_IDS + ['id3'], workers=4)
+    assert list(media) == SNAP_IDS
+    assert media['id3'] == [{'type': 'icon', 'hash': 'abc'}]
+    assert sca.handshakes == 1
+    assert sca.gets() == sorted(SNAP_IDS)
+
+
+def test_media_for_reuses_pooled_clients(sca, store):
+    store.media_for(SNAP_IDS[:10], workers=4)
+    clients = set(sca.clients)
+    assert len(clients) <= 4
+    sca.clients.clear()
+    store.media_for(SNAP_IDS[10:], workers=4)
+    # The second call makes its requests with the same clients, and so
+    # over the same sessions.
+    assert sca.clients <= clients
+    assert sca.handshakes == 1
+
+
+def test_media_for_uses_cache(sca, store):
+    store.media_for(SNAP_IDS, workers=4)
+    sca.requests.clear()
+    assert store.media_for(SNAP_IDS[:5], workers=4) == {
+        snap_id: [] for snap_id in SNAP_IDS[:5]}
+    assert sca.requests == []
+
+
+def test_media_for_explicit_client(sca):
+    client = Client()
+    store = Store(client)
+    store.media_for(SNAP_IDS, workers=4)
+    assert all(snap_id in client.media_cache for snap_id in SNAP_IDS)
+    assert sca.handshakes == 1
+
+
+def test_writes_invalidate_media_cache(sca, store):
+    store.media_for(['id1', 'id2'])
+    client = store.client
+    fp = io.BytesIO(b'icon data')
+    fp.name = 'icon.png'
+    client.append_binary_metadata('id1', MediaType.icon, fp)
+    sca.requests.clear()
+    media = store.media_for(['id1', 'id2'])
+    assert [item['filename'] for item in media['id1']] == ['icon.png']
+    assert sca.gets() == ['id1']
+
+    client.clear_binary_metadata('id1')
+    sca.requests.clear()
+    store.media_for(['id1', 'id2'])
+    assert sca.gets() == ['id1']
+
+
+def test_stale_fetch_is_not_cached(sca, store):
+    def write_during_fetch(client, snap_id):
+        # Another client writes while this fetch is in flight.
+        sca.on_get = None
+        client.media_cache.invalidate(snap_id)
+
+    sca.on_get = write_during_fetch
+    store.media_for(['id1'])
+    assert 'id1' not in store.client.media_cache
+    store.media_for(['id1'])
+    assert 'id1' in store.client.media_cache
+    assert sca.gets() == ['id1', 'id1']
@@ -0,0 +1,159 @@
+import pytest
+
+from storeclient.enums import RiskType
+from storeclient.watcher import CloseEvent, ReleaseEvent, ReleaseWatcher
+
+
+class FakeResponse:
+    def __init__(self, status_code, data=None, etag=None):
+        self.status_code = status_code
+        self.data = data
+        self.headers = {'ETag': etag} if etag else {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise IOError(f'HTTP {self.status_code}')
+
+
+def channel_map(revisions):
+    return {'channel-map': [
+        {'channel': {'track': 'latest', 'risk': risk,
+                     'architecture': 'amd64'},
+         'revision': revision}
+        for risk, revision in revisions.items()]}
+
+
+class FakeClient:
+    """Serve channel maps with an ETag derived from the revisions."""
+
+    def __init__(self):
+        self.snaps = {}
+        self.requests = []
+
+    def snap_info(self, name, fields=None, etag=None):
+        self.requests.append((name, fields, etag))
+        revisions = self.snaps[name]
+        if isinstance(revisions, Exception):
+            raise revisions
+        if revisions is None:
+            return FakeResponse(404)
+        current = repr(sorted(revisions.items()))
+        if etag == current:
+            return FakeResponse(304)
+        return FakeResponse(200, channel_map(revisions), current)
+
+    def decode(self, r):
+        return r.data
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def client():
+    client = FakeClient()
+    client.snaps['foo'] = {'stable': 1, 'edge': 2}
+    client.snaps['bar'] = {'stable': 5}
+    return client
+
+
+@pytest.fixture
+def clock():
+    return Clock()
+
+
+def make_watcher(client, clock, **kwargs):
+    return ReleaseWatcher(['foo', 'bar'], client=client, clock=clock,
+                          min_interval=10, max_interval=40, **kwargs)
+
+
+def test_first_poll_only_records_state(client, clock):
+    watcher = make_watcher(client, clock)
+    assert watcher.poll_due() == []
+    assert watcher.channels('foo') == {
+        ('latest', RiskType.stable, 'amd64'): 1,
+        ('latest', RiskType.edge, 'amd64'): 2,
+    }
+    assert [name for name, _, _ in client.requests] == ['foo', 'bar']
+
+
+def test_release_and_close_events(client, clock):
+    events = []
+    watcher = make_watcher(client, clock, callback=events.append)
+    watcher.poll('foo')
+    client.snaps['foo'] = {'stable': 3}
+    assert watcher.poll('foo') == events == [
+        ReleaseEvent('foo', 'latest', RiskType.stable, 'amd64',
+                     revision=3, previous_revision=1),
+        CloseEvent('foo', 'latest', RiskType.edge, 'amd64',
+                   previous_revision=2),
+    ]
+
+
+def test_etag_is_sent_and_304_keeps_state(client, clock):
+    watcher = make_watcher(client, clock)
+    watcher.poll('foo')
+    state = watcher.channels('foo')
+    assert watcher.poll('foo') == []
+    first, second = client.requests
+    assert first == ('foo', ['revision'], None)
+    assert second[2] is not None
+    assert watcher.channels('foo') == state
+
+
+def test_interval_grows_and_resets(client, clock):
+    watcher = make_watcher(client, clock)
+    intervals = []
+    for _ in range(4):
+        watcher.poll('foo')
+        intervals.append(watcher._snaps['foo'].next_poll - clock.now)
+    assert intervals == [20, 40, 40, 40]
+    client.snaps['foo'] = {'stable': 4}
+    watcher.poll('foo')
+    assert watcher._snaps['foo'].next_poll - clock.now == 10
+
+
+def test_poll_due_waits_for_interval(client, clock):
+    watcher = make_watcher(client, clock)
+    watcher.poll_due()
+    client.requests.clear()
+    clock.now = 19
+    assert watcher.poll_due() == []
+    assert client.requests == []
+    assert watcher.next_poll() == 20
+    clock.now = 20
+    watcher.poll_due()
+    assert [name for name, _, _ in client.requests] == ['foo', 'bar']
+
+
+def test_failing_snap_does_not_stop_others(client, clock):
+    errors = []
+    watcher = make_watcher(
+        client, clock,
+        error_callback=lambda name, error: errors.append((name, error)))
+    watcher.poll_due()
+    client.snaps['foo'] = None
+    client.snaps['bar'] = {'stable': 6}
+    clock.now = 20
+    events = watcher.poll_due()
+    assert [event.snap for event in events] == ['bar']
+    assert [name for name, _ in errors] == ['foo']
+    assert watcher._snaps['foo'].next_poll == 60
+
+    client.snaps['bar'] = ConnectionError('offline')
+    client.snaps['foo'] = {'stable': 7}
+    clock.now = 60
+    events = watcher.poll_due()
+    assert {event.snap for event in events} == {'foo'}
+    assert [name for name, _ in errors] == ['foo', 'bar']
+
+
+def test_errors_are_printed_without_callback(client, clock, capsys):
+    client.snaps['foo'] = None
+    make_watcher(client, clock).poll_due()
+    assert 'polling foo failed' in capsys.readouterr().err